@@ -1,6 +1,11 @@
 import os
+import queue
 import sqlite3
+import threading
+import re
 import json
+import base64
+from contextlib import contextmanager
 from datetime import datetime
 import uuid
 
@@ -8,23 +13,139 @@ import uuid
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_NAME = os.path.join(BASE_DIR, "lumina_chat.db")
 
-def init_db():
-    """Initialize the database tables."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # Sessions table
-    c.execute('''
+# Connections are shared across FastAPI's thread pool and the executor used by async handlers
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+
+_pool = queue.LifoQueue()
+_pool_lock = threading.Lock()
+_pool_created = 0
+
+# Statement text is kept in constants so each pooled connection's statement cache reuses the prepared form
+SQL_INSERT_SESSION = "INSERT INTO sessions (id, title) VALUES (?, ?)"
+SQL_SELECT_SESSIONS = "SELECT id, title, pinned, created_at FROM sessions ORDER BY pinned DESC, created_at DESC, id DESC"
+SQL_SELECT_MESSAGES = "SELECT role, content, images FROM messages WHERE session_id = ? ORDER BY timestamp ASC, id ASC"
+# Keyset pages: the cursor holds the sort key of the last row returned, so each page is an index seek
+SQL_SESSIONS_PAGE = (
+    "SELECT id, title, pinned, created_at FROM sessions "
+    "WHERE (pinned, created_at, id) < (?, ?, ?) "
+    "ORDER BY pinned DESC, created_at DESC, id DESC LIMIT ?"
+)
+SQL_SESSIONS_FIRST_PAGE = "SELECT id, title, pinned, created_at FROM sessions ORDER BY pinned DESC, created_at DESC, id DESC LIMIT ?"
+SQL_MESSAGES_PAGE = (
+    "SELECT id, role, content, images, timestamp FROM messages "
+    "WHERE session_id = ? AND (timestamp, id) < (?, ?) "
+    "ORDER BY timestamp DESC, id DESC LIMIT ?"
+)
+SQL_MESSAGES_FIRST_PAGE = (
+    "SELECT id, role, content, images, timestamp FROM messages "
+    "WHERE session_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?"
+)
+SQL_INSERT_CHUNK = "INSERT INTO chunks_fts (content, chunk_id, session_id, filename, fingerprint) VALUES (?, ?, ?, ?, ?)"
+# A session sees its own chunks plus those of every shared file it references
+SQL_SEARCH_CHUNKS = (
+    "SELECT chunk_id, content, filename, bm25(chunks_fts) AS score FROM chunks_fts "
+    "WHERE chunks_fts MATCH ? AND (session_id = ? OR fingerprint IN "
+    "(SELECT fingerprint FROM session_files WHERE session_id = ?)) ORDER BY score LIMIT ?"
+)
+SQL_SEARCH_ALL_CHUNKS = (
+    "SELECT chunk_id, content, filename, bm25(chunks_fts) AS score FROM chunks_fts "
+    "WHERE chunks_fts MATCH ? ORDER BY score LIMIT ?"
+)
+SQL_DELETE_SESSION_CHUNKS = "DELETE FROM chunks_fts WHERE session_id = ?"
+SQL_DELETE_ALL_CHUNKS = "DELETE FROM chunks_fts"
+SQL_DELETE_ORPHAN_CHUNKS = (
+    "DELETE FROM chunks_fts WHERE (session_id != '' AND session_id NOT IN (SELECT id FROM sessions)) "
+    "OR (fingerprint != '' AND fingerprint NOT IN (SELECT fingerprint FROM files))"
+)
+SQL_DELETE_FILE_CHUNKS = "DELETE FROM chunks_fts WHERE fingerprint = ?"
+# Shared-file registry: one files row per distinct content hash, one session_files row per reference
+# Status, and whether the current claim on the file is older than the given '-N seconds' modifier
+SQL_SELECT_FILE_STATUS = "SELECT status, created_at < datetime('now', ?) FROM files WHERE fingerprint = ?"
+SQL_INSERT_FILE = "INSERT INTO files (fingerprint, filename, size) VALUES (?, ?, ?)"
+SQL_SELECT_SESSION_FILE = "SELECT 1 FROM session_files WHERE session_id = ? AND fingerprint = ?"
+SQL_INSERT_SESSION_FILE = "INSERT INTO session_files (session_id, fingerprint, filename) VALUES (?, ?, ?)"
+SQL_DELETE_SESSION_FILE = "DELETE FROM session_files WHERE session_id = ? AND fingerprint = ?"
+SQL_RELEASE_FILE_CLAIM = "UPDATE files SET status = ? WHERE fingerprint = ? AND status = 'pending'"
+SQL_MARK_FILE_READY = "UPDATE files SET status = ?, chunk_count = ? WHERE fingerprint = ?"
+SQL_RECLAIM_FILE = "UPDATE files SET status = 'pending', created_at = CURRENT_TIMESTAMP WHERE fingerprint = ?"
+SQL_SELECT_SESSION_FINGERPRINTS = "SELECT fingerprint FROM session_files WHERE session_id = ? ORDER BY added_at, fingerprint"
+SQL_DELETE_SESSION_FILES = "DELETE FROM session_files WHERE session_id = ?"
+SQL_DELETE_ORPHAN_SESSION_FILES = "DELETE FROM session_files WHERE session_id NOT IN (SELECT id FROM sessions)"
+SQL_SELECT_UNREFERENCED_FILES = (
+    "SELECT fingerprint FROM files WHERE NOT EXISTS "
+    "(SELECT 1 FROM session_files WHERE session_files.fingerprint = files.fingerprint)"
+)
+SQL_DELETE_FILE = "DELETE FROM files WHERE fingerprint = ?"
+SQL_SELECT_FINGERPRINTS = "SELECT fingerprint FROM files"
+SQL_DELETE_ALL_SESSION_FILES = "DELETE FROM session_files"
+SQL_DELETE_ALL_FILES = "DELETE FROM files"
+SQL_SAVE_DEFINITION = "INSERT OR REPLACE INTO definitions (key, word, definition, created_at) VALUES (?, ?, ?, ?)"
+SQL_DELETE_EXPIRED_DEFINITIONS = "DELETE FROM definitions WHERE created_at < ?"
+SQL_SELECT_SESSION_IDS = "SELECT id FROM sessions"
+SQL_INSERT_MESSAGE = "INSERT INTO messages (session_id, role, content, images) VALUES (?, ?, ?, ?)"
+SQL_UPDATE_TITLE = "UPDATE sessions SET title = ? WHERE id = ?"
+SQL_AUTO_TITLE = "UPDATE sessions SET title = ? WHERE id = ? AND title = 'New Chat'"
+SQL_UPDATE_PINNED = "UPDATE sessions SET pinned = ? WHERE id = ?"
+SQL_DELETE_SESSION = "DELETE FROM sessions WHERE id = ?"
+SQL_DELETE_ALL_SESSIONS = "DELETE FROM sessions"
+
+def _connect():
+    conn = sqlite3.connect(DB_NAME, timeout=30, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+def _acquire():
+    global _pool_created
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        pass
+    with _pool_lock:
+        if _pool_created < POOL_SIZE:
+            _pool_created += 1
+            return _connect()
+    # Pool exhausted: wait for another thread to hand a connection back
+    return _pool.get()
+
+@contextmanager
+def transaction():
+    """Borrows a pooled connection and runs the block as one transaction (commit or rollback)."""
+    conn = _acquire()
+    try:
+        with conn:
+            yield conn
+    finally:
+        _pool.put(conn)
+
+def close_pool():
+    global _pool_created
+    with _pool_lock:
+        while True:
+            try:
+                _pool.get_nowait().close()
+            except queue.Empty:
+                break
+        _pool_created = 0
+
+# Ordered schema migrations: (version, description, statements). The applied version is stored in
+# PRAGMA user_version, so existing lumina_chat.db files are upgraded in place on startup.
+MIGRATIONS = [
+    (1, "sessions and messages tables", [
+        '''
         CREATE TABLE IF NOT EXISTS sessions (
             id TEXT PRIMARY KEY,
             title TEXT,
             pinned INTEGER DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Messages table
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_id TEXT,
@@ -34,83 +155,329 @@ def init_db():
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY(session_id) REFERENCES sessions(id) ON DELETE CASCADE
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
+        ''',
+    ]),
+    (2, "indexes for session listing and history, purge orphaned messages", [
+        # Rows left behind while foreign keys were not enforced
+        "DELETE FROM messages WHERE session_id IS NULL OR session_id NOT IN (SELECT id FROM sessions)",
+        # Covers get_sessions entirely, in index order
+        "CREATE INDEX IF NOT EXISTS idx_sessions_listing ON sessions(pinned DESC, created_at DESC, id, title)",
+        # Serves the session_id filter and the timestamp sort (and the ON DELETE CASCADE lookup)
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_time ON messages(session_id, timestamp, id)",
+    ]),
+    (3, "keyset pagination index for sessions", [
+        # Same listing order with a unique id tiebreak, so (pinned, created_at, id) cursors are a range seek
+        "DROP INDEX IF EXISTS idx_sessions_listing",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_keyset ON sessions(pinned DESC, created_at DESC, id DESC, title)",
+    ]),
+    (4, "full-text keyword index over document chunks", [
+        # BM25 index over the same chunks stored in Chroma (chunk_id is the Chroma id)
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+        "content, chunk_id UNINDEXED, session_id UNINDEXED, filename UNINDEXED, tokenize='unicode61')",
+    ]),
+    (5, "file fingerprint registry for deduplicated, shared uploads", [
+        # refs = rows in session_files; a file's chunks and vectors are dropped when the last one goes
+        '''
+        CREATE TABLE IF NOT EXISTS files (
+            fingerprint TEXT PRIMARY KEY, -- sha256 of the uploaded bytes
+            filename TEXT,
+            size INTEGER,
+            status TEXT DEFAULT 'pending', -- 'ready' once every chunk is stored
+            chunk_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS session_files (
+            session_id TEXT,
+            fingerprint TEXT,
+            filename TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_id, fingerprint)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_session_files_fingerprint ON session_files(fingerprint)",
+        # FTS5 tables can't gain columns, so the keyword index is rebuilt with a fingerprint column
+        "CREATE VIRTUAL TABLE chunks_fts_v5 USING fts5("
+        "content, chunk_id UNINDEXED, session_id UNINDEXED, filename UNINDEXED, fingerprint UNINDEXED, tokenize='unicode61')",
+        "INSERT INTO chunks_fts_v5 (content, chunk_id, session_id, filename, fingerprint) "
+        "SELECT content, chunk_id, session_id, filename, '' FROM chunks_fts",
+        "DROP TABLE chunks_fts",
+        "ALTER TABLE chunks_fts_v5 RENAME TO chunks_fts",
+    ]),
+    (6, "persistent cache for /define lookups", [
+        # key = normalized word + context fingerprint (services/definition_cache.py)
+        '''
+        CREATE TABLE IF NOT EXISTS definitions (
+            key TEXT PRIMARY KEY,
+            word TEXT,
+            definition TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_definitions_created ON definitions(created_at)",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version():
+    with transaction() as c:
+        return c.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    """Brings the database schema up to SCHEMA_VERSION, applying each pending migration once."""
+    with transaction() as c:
+        # Take the write lock first so concurrent workers don't apply the same migration twice
+        c.execute("BEGIN IMMEDIATE")
+        current = c.execute("PRAGMA user_version").fetchone()[0]
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for statement in statements:
+                c.execute(statement)
+            c.execute(f"PRAGMA user_version = {version}")
+            print(f"DB migrated to schema v{version}: {description}")
 
 def create_session(title="New Chat"):
     session_id = str(uuid.uuid4())
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO sessions (id, title) VALUES (?, ?)", (session_id, title))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute(SQL_INSERT_SESSION, (session_id, title))
     return session_id
 
 def get_sessions():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Order by pinned (desc) then created_at (desc)
-    c.execute("SELECT id, title, pinned, created_at FROM sessions ORDER BY pinned DESC, created_at DESC")
-    rows = c.fetchall()
-    conn.close()
+    with transaction() as c:
+        # Order by pinned (desc) then created_at (desc)
+        rows = c.execute(SQL_SELECT_SESSIONS).fetchall()
     return [{"id": r[0], "title": r[1], "pinned": bool(r[2]), "created_at": r[3]} for r in rows]
 
+def _decode_images(raw):
+    if not raw:
+        return []
+    try:
+        return json.loads(raw)
+    except:
+        return []
+
 def get_session_messages(session_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT role, content, images FROM messages WHERE session_id = ? ORDER BY timestamp ASC", (session_id,))
-    rows = c.fetchall()
-    conn.close()
-    messages = []
-    for r in rows:
-        images = []
-        if r[2]:
-            try:
-                images = json.loads(r[2])
-            except:
-                images = []
-        messages.append({"role": r[0], "content": r[1], "images": images})
-    return messages
+    with transaction() as c:
+        rows = c.execute(SQL_SELECT_MESSAGES, (session_id,)).fetchall()
+    return [{"role": r[0], "content": r[1], "images": _decode_images(r[2])} for r in rows]
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, types):
+    """Raises ValueError unless the cursor holds exactly one value of each type in `types`."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != len(types):
+        raise ValueError("Invalid cursor")
+    # bool is an int subclass, but never part of a cursor
+    if any(isinstance(v, bool) or not isinstance(v, t) for v, t in zip(key, types)):
+        raise ValueError("Invalid cursor")
+    return key
+
+def get_sessions_page(limit, cursor=None):
+    """One page of sessions in listing order, plus the cursor for the next page (None on the last page)."""
+    with transaction() as c:
+        if cursor:
+            pinned, created_at, last_id = decode_cursor(cursor, (int, str, str))
+            rows = c.execute(SQL_SESSIONS_PAGE, (pinned, created_at, last_id, limit + 1)).fetchall()
+        else:
+            rows = c.execute(SQL_SESSIONS_FIRST_PAGE, (limit + 1,)).fetchall()
+    next_cursor = encode_cursor([rows[limit - 1][2], rows[limit - 1][3], rows[limit - 1][0]]) if len(rows) > limit else None
+    sessions = [{"id": r[0], "title": r[1], "pinned": bool(r[2]), "created_at": r[3]} for r in rows[:limit]]
+    return sessions, next_cursor
+
+def get_session_messages_page(session_id, limit, cursor=None):
+    """The newest `limit` messages older than the cursor, returned oldest-first, plus the cursor for older ones."""
+    with transaction() as c:
+        if cursor:
+            timestamp, last_id = decode_cursor(cursor, (str, int))
+            rows = c.execute(SQL_MESSAGES_PAGE, (session_id, timestamp, last_id, limit + 1)).fetchall()
+        else:
+            rows = c.execute(SQL_MESSAGES_FIRST_PAGE, (session_id, limit + 1)).fetchall()
+    next_cursor = encode_cursor([rows[limit - 1][4], rows[limit - 1][0]]) if len(rows) > limit else None
+    messages = [{"role": r[1], "content": r[2], "images": _decode_images(r[3])} for r in reversed(rows[:limit])]
+    return messages, next_cursor
 
 def add_message(session_id, role, content, images=None):
-    if not images:
-        images = []
-    images_json = json.dumps(images)
-    
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO messages (session_id, role, content, images) VALUES (?, ?, ?, ?)", 
-              (session_id, role, content, images_json))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute(SQL_INSERT_MESSAGE, (session_id, role, content, json.dumps(images or [])))
+
+def auto_title(message):
+    return (message[:40] + '...') if len(message) > 40 else message
+
+def save_chat_turn(session_id, user_message, answer, images=None):
+    """Persists a whole chat turn (user message, auto-title, bot reply) in one pooled transaction."""
+    with transaction() as c:
+        c.execute(SQL_INSERT_MESSAGE, (session_id, "user", user_message, "[]"))
+        c.execute(SQL_AUTO_TITLE, (auto_title(user_message), session_id))
+        c.execute(SQL_INSERT_MESSAGE, (session_id, "bot", answer, json.dumps(images or [])))
 
 def update_session(session_id, title=None, pinned=None):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    if title is not None:
-        c.execute("UPDATE sessions SET title = ? WHERE id = ?", (title, session_id))
-    if pinned is not None:
-        # Convert boolean to integer implementation 
-        pin_val = 1 if pinned else 0
-        c.execute("UPDATE sessions SET pinned = ? WHERE id = ?", (pin_val, session_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        if title is not None:
+            c.execute(SQL_UPDATE_TITLE, (title, session_id))
+        if pinned is not None:
+            # Convert boolean to integer implementation
+            pin_val = 1 if pinned else 0
+            c.execute(SQL_UPDATE_PINNED, (pin_val, session_id))
+
+def _release_unreferenced_files(c):
+    """Deletes files no session references any more (and their keyword rows); returns their fingerprints."""
+    released = [r[0] for r in c.execute(SQL_SELECT_UNREFERENCED_FILES).fetchall()]
+    for fingerprint in released:
+        c.execute(SQL_DELETE_FILE_CHUNKS, (fingerprint,))
+        c.execute(SQL_DELETE_FILE, (fingerprint,))
+    return released
 
 def delete_session(session_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    conn.commit() # Cascade delete handles messages
-    conn.close()
+    """Deletes the session and drops its file references; returns fingerprints of files nothing uses now."""
+    with transaction() as c:
+        c.execute(SQL_DELETE_SESSION, (session_id,)) # Cascade delete handles messages
+        c.execute(SQL_DELETE_SESSION_CHUNKS, (session_id,))
+        c.execute(SQL_DELETE_SESSION_FILES, (session_id,))
+        return _release_unreferenced_files(c)
 
 def clear_all_sessions():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM sessions")
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute(SQL_DELETE_ALL_SESSIONS)
+        c.execute(SQL_DELETE_ALL_CHUNKS)
+        c.execute(SQL_DELETE_ALL_SESSION_FILES)
+        c.execute(SQL_DELETE_ALL_FILES)
+
+def get_session_ids():
+    with transaction() as c:
+        return {r[0] for r in c.execute(SQL_SELECT_SESSION_IDS)}
+
+def delete_orphan_chunks():
+    """Removes keyword-index rows whose session or shared file no longer exists; returns how many."""
+    with transaction() as c:
+        return c.execute(SQL_DELETE_ORPHAN_CHUNKS).rowcount
+
+def release_orphan_files():
+    """Drops file references held by deleted sessions; returns fingerprints of files nothing uses now."""
+    with transaction() as c:
+        c.execute(SQL_DELETE_ORPHAN_SESSION_FILES)
+        return _release_unreferenced_files(c)
+
+def get_file_fingerprints():
+    with transaction() as c:
+        return {r[0] for r in c.execute(SQL_SELECT_FINGERPRINTS)}
+
+def register_file(session_id, fingerprint, filename, size, stale_after=3600):
+    """Records that a session uploaded this content.
+
+    Returns "duplicate" if the session already has it, "shared" if its chunks are already stored
+    (the session now references them), or "new" if it still has to be ingested. Only one upload
+    ingests a file: while another is at it, "pending" is returned and nothing is recorded, unless
+    that claim is older than `stale_after` seconds or failed, in which case it is taken over. A
+    'degraded' file (stored without its vision description) is claimed for another attempt and
+    "retry" is returned; its chunks stay in place until the caller swaps in the new ones.
+    """
+    with transaction() as c:
+        c.execute("BEGIN IMMEDIATE")
+        if c.execute(SQL_SELECT_SESSION_FILE, (session_id, fingerprint)).fetchone():
+            return "duplicate"
+        row = c.execute(SQL_SELECT_FILE_STATUS, (f"-{int(stale_after)} seconds", fingerprint)).fetchone()
+        result = "new"
+        if row is None:
+            c.execute(SQL_INSERT_FILE, (fingerprint, filename, size))
+        elif row[0] == "ready":
+            result = "shared"
+        elif row[0] == "pending" and not row[1]:
+            return "pending"
+        elif row[0] in ("pending", "failed"):
+            # Chunks stored by the earlier attempt are kept and skipped by id
+            c.execute(SQL_RECLAIM_FILE, (fingerprint,))
+        elif row[0] == "degraded":
+            c.execute(SQL_RECLAIM_FILE, (fingerprint,))
+            result = "retry"
+        c.execute(SQL_INSERT_SESSION_FILE, (session_id, fingerprint, filename))
+        return result
+
+def unregister_file(session_id, fingerprint, status="failed"):
+    """Undoes register_file after a failed ingest, so the same upload (or one waiting on it) can retry.
+
+    A failed retry of a degraded file passes status="degraded", since its earlier chunks are still in place.
+    """
+    with transaction() as c:
+        c.execute(SQL_DELETE_SESSION_FILE, (session_id, fingerprint))
+        c.execute(SQL_RELEASE_FILE_CLAIM, (status, fingerprint))
+
+def mark_file_ready(fingerprint, chunk_count, degraded=False):
+    """Marks an ingested file shareable; a degraded one stays searchable but is re-ingested on its next upload."""
+    with transaction() as c:
+        c.execute(SQL_MARK_FILE_READY, ("degraded" if degraded else "ready", chunk_count, fingerprint))
+
+def get_session_fingerprints(session_id):
+    with transaction() as c:
+        return [r[0] for r in c.execute(SQL_SELECT_SESSION_FINGERPRINTS, (session_id,))]
+
+def replace_file_chunks(fingerprint, rows):
+    """Swaps a file's keyword rows for `rows` (same shape as index_chunks) in one transaction."""
+    with transaction() as c:
+        c.execute(SQL_DELETE_FILE_CHUNKS, (fingerprint,))
+        c.executemany(SQL_INSERT_CHUNK, [
+            (content, chunk_id, session_id, filename, fp)
+            for chunk_id, session_id, filename, content, fp in rows
+        ])
+
+def index_chunks(rows):
+    """Adds (chunk_id, session_id, filename, content, fingerprint) rows to the keyword index.
+
+    Chunks of a shared file carry its fingerprint and an empty session_id.
+    """
+    with transaction() as c:
+        c.executemany(SQL_INSERT_CHUNK, [
+            (content, chunk_id, session_id, filename, fingerprint)
+            for chunk_id, session_id, filename, content, fingerprint in rows
+        ])
+
+def get_definitions(keys, not_before):
+    """{key: (definition, created_at)} for keys, skipping any stored before `not_before` (epoch seconds)."""
+    found = {}
+    with transaction() as c:
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            found.update(
+                (key, (definition, created_at)) for key, definition, created_at in c.execute(
+                    f"SELECT key, definition, created_at FROM definitions WHERE key IN ({placeholders}) AND created_at >= ?",
+                    (*part, not_before)
+                )
+            )
+    return found
+
+def save_definitions(rows):
+    """Stores (key, word, definition, created_at) rows."""
+    with transaction() as c:
+        c.executemany(SQL_SAVE_DEFINITION, rows)
+
+def delete_expired_definitions(before):
+    with transaction() as c:
+        return c.execute(SQL_DELETE_EXPIRED_DEFINITIONS, (before,)).rowcount
+
+def _fts_query(text):
+    # Quote every term so user input can't be parsed as FTS5 syntax; any term may match
+    terms = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{t}"' for t in dict.fromkeys(terms))
+
+def search_chunks(query, session_id=None, limit=10):
+    """BM25-ranked keyword search over indexed chunks, best match first."""
+    match = _fts_query(query)
+    if not match:
+        return []
+    with transaction() as c:
+        if session_id:
+            rows = c.execute(SQL_SEARCH_CHUNKS, (match, session_id, session_id, limit)).fetchall()
+        else:
+            rows = c.execute(SQL_SEARCH_ALL_CHUNKS, (match, limit)).fetchall()
+    return [{"id": r[0], "document": r[1], "metadata": {"filename": r[2]}, "score": -r[3]} for r in rows]
 
 # Initialize on module load check if needed, but safe to call explicitly in main.py
 if __name__ == "__main__":
@@ -1,14 +1,94 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from services.rag_service import rag_service
+from services.executors import run_blocking, shutdown_pools
+from services.ingest_queue import IngestQueue, QueueFullError, SpooledUpload, UploadTooLargeError, MAX_UPLOAD_BYTES
+from services import maintenance, vision, upstream, metrics
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Literal
+from contextlib import asynccontextmanager
 import database as db
+import asyncio
+import time
+import os
 
-app = FastAPI()
+# Uploads are parsed and embedded by background workers; /upload only enqueues
+ingest_queue = IngestQueue(rag_service.process_file)
 
-# Initialize DB
-db.init_db()
+# What /readyz waits for: schema migrations, then the SDK clients, embedder and Chroma being built
+readiness = {"database": False, "schema_version": None, "warmup": False, "error": None}
+
+async def warm_up():
+    try:
+        timings = await run_blocking("vector", rag_service.warmup)
+        readiness["warmup"] = True
+        print(f"Warmup finished: {timings}")
+    except Exception as e:
+        readiness["error"] = f"warmup: {e}"
+        print(f"Warmup failed: {e}")
+    # Older installs kept every session's chunks in one collection; move them in the background.
+    # Attempted even if warmup failed, or retrieval would keep searching the legacy collection
+    try:
+        await run_blocking("vector", rag_service.migrate_legacy_vectors)
+    except Exception as e:
+        print(f"Legacy vector migration failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Initialize DB
+    await run_blocking("io", db.init_db)
+    readiness["schema_version"] = await run_blocking("io", db.get_schema_version)
+    readiness["database"] = True
+    ingest_queue.start()
+    background = [asyncio.create_task(warm_up())]
+    if maintenance.MAINTENANCE_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(maintenance.run_periodically(rag_service, ingest_queue)))
+    yield
+    for task in background:
+        task.cancel()
+    await ingest_queue.stop()
+    vision.close_client()
+    shutdown_pools()
+    db.close_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+# Room for the multipart boundaries and the session_id field around the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+@app.middleware("http")
+async def reject_oversized_uploads(request, call_next):
+    # Checked on the declared length, before the body is read; chunked uploads are checked while spooling
+    if request.url.path == "/upload" and request.headers.get("content-length", "").isdigit():
+        length = int(request.headers["content-length"])
+        if length > MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD:
+            return JSONResponse(status_code=413, content={"detail": f"Upload is larger than the {MAX_UPLOAD_BYTES} byte limit"})
+        if not ingest_queue.has_room_for(length - UPLOAD_FORM_OVERHEAD):
+            return JSONResponse(
+                status_code=503, content={"detail": "Too many uploads in progress, try again shortly"},
+                headers={"Retry-After": "5"}
+            )
+    return await call_next(request)
+
+@app.middleware("http")
+async def time_requests(request, call_next):
+    # Labelled by route template rather than raw path, so session ids don't create a series each
+    timings, token = metrics.start_request_timing()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.end_request_timing(token)
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method, route=getattr(route, "path", "unmatched"), status=response.status_code
+    )
+    if metrics.SERVER_TIMING_HEADER and timings:
+        # Streamed responses only include the stages finished before the first byte
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
 
 # Allow frontend connection
 app.add_middleware(
@@ -22,17 +102,33 @@ class ChatRequest(BaseModel):
     message: str
     include_images: bool = False
     session_id: Optional[str] = None
+    # "hybrid" (default), "keyword" (no embedding call) or "vector" (no keyword index); unset uses RETRIEVAL_MODE
+    retrieval_mode: Optional[Literal["hybrid", "keyword", "vector"]] = None
+
+# Session and history listings are paged; ?all=true returns everything in the old shape
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class DefineTerm(BaseModel):
+    word: str
+    context: str = ""
+
+class DefineBatchRequest(BaseModel):
+    terms: List[DefineTerm]
+
+MAX_DEFINE_TERMS = 200
 
 class SessionUpdate(BaseModel):
     title: Optional[str] = None
     pinned: Optional[bool] = None
 
+import json
 import logging
 import traceback
 
-# Setup logging
+# Setup logging (per-query retrieval details are only written at LOG_LEVEL=DEBUG)
 logger = logging.getLogger("lumina")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 handler = logging.FileHandler("backend_debug.log")
 handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logger.addHandler(handler)
@@ -44,20 +140,45 @@ async def upload_document(
 ):
     try:
         logger.info(f"Uploading file: {file.filename} for session: {session_id}")
-        await rag_service.process_file(file, session_id)
-        return {"status": "success"}
+        try:
+            upload = await SpooledUpload.from_upload(file)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        try:
+            job = ingest_queue.submit(upload, session_id)
+        except QueueFullError as e:
+            upload.close()
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        return {"status": "queued", "job_id": job.id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/upload/{job_id}")
+def get_upload_status(job_id: str):
+    job = ingest_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown upload job")
+    return job.to_dict()
+
 @app.get("/sessions")
-def get_sessions():
+def get_sessions(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                 all: bool = False):
     try:
         print("API CALL: getting sessions...")
-        sessions = db.get_sessions()
+        if all:
+            # Unpaginated list, only for older clients that ask for it explicitly
+            sessions = db.get_sessions()
+            print(f"API SUCCESS: Found {len(sessions)} sessions")
+            return sessions
+        sessions, next_cursor = db.get_sessions_page(limit, cursor)
         print(f"API SUCCESS: Found {len(sessions)} sessions")
-        return sessions
+        return {"sessions": sessions, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"API ERROR [get_sessions]: {e}")
         import traceback
@@ -78,9 +199,17 @@ def create_session():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/sessions/{session_id}")
-def get_session_history(session_id: str):
-    messages = db.get_session_messages(session_id)
-    return {"messages": messages}
+def get_session_history(session_id: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        cursor: Optional[str] = None, all: bool = False):
+    if all:
+        messages = db.get_session_messages(session_id)
+        return {"messages": messages, "next_cursor": None}
+    # Pages walk backwards from the newest message; next_cursor fetches the older page
+    try:
+        messages, next_cursor = db.get_session_messages_page(session_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"messages": messages, "next_cursor": next_cursor}
 
 @app.put("/sessions/{session_id}")
 def update_session(session_id: str, update: SessionUpdate):
@@ -89,7 +218,10 @@ def update_session(session_id: str, update: SessionUpdate):
 
 @app.delete("/sessions/{session_id}")
 def delete_session(session_id: str):
-    db.delete_session(session_id)
+    released_files = db.delete_session(session_id)
+    rag_service.delete_session_vectors(session_id)
+    # Shared files are only dropped once no other session references them
+    rag_service.delete_file_vectors(released_files)
     return {"status": "deleted"}
 
 @app.delete("/sessions")
@@ -98,6 +230,14 @@ def clear_all_sessions():
     rag_service.clear_storage()
     return {"status": "all_cleared"}
 
+@app.post("/maintenance/gc")
+async def run_maintenance():
+    """Deletes orphaned vectors and keyword rows, compacts ./chroma_db and reports what was reclaimed."""
+    report = await maintenance.run(rag_service, ingest_queue)
+    if report.get("status") == "busy":
+        raise HTTPException(status_code=409, detail="Maintenance is already running")
+    return report
+
 @app.post("/chat")
 async def chat(request: ChatRequest):
     # Ensure session exists or create on the fly?
@@ -107,30 +247,88 @@ async def chat(request: ChatRequest):
     # Implementation choice: if session_id provided, save.
     
     sid = request.session_id
-    if sid:
-        # Save user message
-        db.add_message(sid, "user", request.message)
-        
-        # Auto-title logic
-        sessions = db.get_sessions()
-        current_session = next((s for s in sessions if s['id'] == sid), None)
-        if current_session and current_session['title'] == "New Chat":
-            new_title = (request.message[:40] + '...') if len(request.message) > 40 else request.message
-            db.update_session(sid, title=new_title)
-    
-    response = await rag_service.query(request.message, request.include_images, sid)
+    response = await rag_service.query(request.message, request.include_images, sid, request.retrieval_mode)
     
     if sid:
-        # Save bot message
-        db.add_message(sid, "bot", response.get("answer"), response.get("images"))
+        # Save user message, auto-title and bot message in a single transaction
+        await metrics.timed("db_write", run_blocking(
+            "io", db.save_chat_turn, sid, request.message, response.get("answer"), response.get("images")
+        ))
 
     return response
 
+# Chat turns being saved after their stream ended; held so the tasks aren't garbage collected
+pending_saves = set()
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Server-Sent Events variant of /chat: meta, then answer tokens, then images, then done."""
+    sid = request.session_id
+
+    async def event_stream():
+        answer_parts = []
+        images = []
+        try:
+            async for event, data in rag_service.query_stream(request.message, request.include_images, sid, request.retrieval_mode):
+                if event == "token":
+                    answer_parts.append(data["text"])
+                elif event == "images":
+                    images = data["images"]
+                elif event == "error":
+                    answer_parts = [data["detail"]]
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            if sid:
+                # Save the turn with whatever was streamed, also when the client disconnected mid-answer.
+                # The save runs as its own task, so cancelling this response doesn't cancel it
+                save = asyncio.create_task(metrics.timed("db_write", run_blocking(
+                    "io", db.save_chat_turn, sid, request.message, "".join(answer_parts), images
+                )))
+                pending_saves.add(save)
+                save.add_done_callback(pending_saves.discard)
+                await asyncio.shield(save)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/define")
 async def define_term(body: dict):
     # body should be {"word": "some word", "context": "surrounding text"}
     return await rag_service.define_word(body.get("word", ""), body.get("context", ""))
 
+@app.post("/define/batch")
+async def define_terms(request: DefineBatchRequest):
+    """Defines many highlighted terms at once; cached terms are answered without an upstream call."""
+    if len(request.terms) > MAX_DEFINE_TERMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_DEFINE_TERMS} terms per request")
+    definitions = await rag_service.define_words([(t.word, t.context) for t in request.terms])
+    return {"definitions": definitions}
+
+@app.get("/healthz")
+def liveness():
+    """The process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readiness_probe():
+    """Ready once the schema is migrated and the clients are warmed up; 503 until then."""
+    ready = readiness["database"] and readiness["warmup"]
+    body = {"status": "ready" if ready else "starting", **readiness}
+    return body if ready else JSONResponse(status_code=503, content=body)
+
+@app.get("/metrics")
+def get_metrics():
+    """Stage latencies, cache hits, chunk counts and upstream errors in the Prometheus text format."""
+    for name, provider in upstream.stats().items():
+        metrics.UPSTREAM_CONCURRENCY.set(provider["concurrency_limit"], provider=name)
+        metrics.UPSTREAM_IN_FLIGHT.set(provider["in_flight"], provider=name)
+    metrics.INGEST_QUEUE_DEPTH.set(ingest_queue.depth())
+    metrics.INGEST_BYTES_IN_FLIGHT.set(ingest_queue.bytes_in_flight)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,269 @@
+import os
+import re
+
+# Token budget per chunk and overlap between neighbouring chunks (in estimated tokens)
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "auto")
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "30"))
+LEGACY_CHUNK_CHARS = 1200
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_WORD_RE = re.compile(r"\S+")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s")
+_TABLE_RE = re.compile(r"^\s*\|")
+
+MARKDOWN_EXTENSIONS = (".md", ".markdown", ".rst")
+CODE_EXTENSIONS = (".py", ".js", ".jsx", ".ts", ".tsx", ".java", ".c", ".h", ".cpp", ".cs", ".go", ".rs", ".rb", ".php", ".sql", ".sh", ".css", ".html")
+
+
+def count_tokens(text: str) -> int:
+    """Cheap, model-agnostic token estimate (words and punctuation marks)."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def _chunk(text, start, end, tokens=None):
+    return {"text": text[start:end], "start": start, "end": end,
+            "tokens": tokens if tokens is not None else count_tokens(text[start:end])}
+
+
+def _sentence_spans(text, start=0, end=None):
+    """(start, end) spans of sentences/paragraphs within text[start:end], whitespace trimmed."""
+    end = len(text) if end is None else end
+    spans = []
+    cursor = start
+    for m in _SENTENCE_BREAK_RE.finditer(text, start, end):
+        if m.start() > cursor:
+            spans.append((cursor, m.start()))
+        cursor = m.end()
+    if cursor < end:
+        spans.append((cursor, end))
+    return [(s, e) for s, e in spans if text[s:e].strip()]
+
+
+def _paragraph_spans(text):
+    spans = []
+    cursor = 0
+    for m in re.finditer(r"\n\s*\n", text):
+        if text[cursor:m.start()].strip():
+            spans.append((cursor, m.start()))
+        cursor = m.end()
+    if text[cursor:].strip():
+        spans.append((cursor, len(text)))
+    return spans
+
+
+def _line_spans(text, start, end):
+    spans = []
+    cursor = start
+    while cursor < end:
+        nl = text.find("\n", cursor, end)
+        stop = end if nl == -1 else nl + 1
+        if text[cursor:stop].strip():
+            spans.append((cursor, stop))
+        cursor = stop
+    return spans
+
+
+class Chunker:
+    """Base class: split(text) returns chunk dicts with text, start/end offsets and a token estimate."""
+
+    name = "base"
+
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP):
+        self.max_tokens = max(max_tokens, 1)
+        self.overlap = max(min(overlap, self.max_tokens // 2), 0)
+
+    def split(self, text: str):
+        raise NotImplementedError
+
+    def _split_words(self, text, start, end):
+        """Hard split for a single unit larger than the budget, at word boundaries.
+
+        A word that is itself over budget (minified JSON, base64, long URLs) is cut into runs of
+        max_tokens tokens, so every unit handed back to _pack fits.
+        """
+        units = []
+        for m in _WORD_RE.finditer(text, start, end):
+            tokens = count_tokens(m.group())
+            if tokens <= self.max_tokens:
+                units.append((m.start(), m.end(), tokens, False))
+                continue
+            spans = [(t.start(), t.end()) for t in _TOKEN_RE.finditer(text, m.start(), m.end())]
+            for i in range(0, len(spans), self.max_tokens):
+                piece = spans[i:i + self.max_tokens]
+                units.append((piece[0][0], piece[-1][1], len(piece), False))
+        return self._pack(text, units)
+
+    def _pack(self, text, units):
+        """Greedily packs (start, end, tokens, break_before) units into budgeted chunks with overlap."""
+        chunks = []
+        window = []
+        window_tokens = 0
+
+        def flush():
+            nonlocal window, window_tokens
+            if not window:
+                return
+            chunks.append(_chunk(text, window[0][0], window[-1][1], window_tokens))
+            # Carry the tail of this chunk into the next one as overlap
+            carried = []
+            carried_tokens = 0
+            for unit in reversed(window):
+                if carried_tokens + unit[2] > self.overlap:
+                    break
+                carried.insert(0, unit)
+                carried_tokens += unit[2]
+            if len(carried) == len(window):
+                carried, carried_tokens = [], 0
+            window, window_tokens = carried, carried_tokens
+
+        for start, end, tokens, break_before in units:
+            if break_before:
+                flush()
+                window, window_tokens = [], 0
+            if tokens > self.max_tokens:
+                flush()
+                window, window_tokens = [], 0
+                chunks.extend(self._split_words(text, start, end))
+                continue
+            if window and window_tokens + tokens > self.max_tokens:
+                flush()
+                # Drop overlap that would not leave room for this unit
+                while window and window_tokens + tokens > self.max_tokens:
+                    window_tokens -= window.pop(0)[2]
+            window.append((start, end, tokens, break_before))
+            window_tokens += tokens
+        if window and (not chunks or window[-1][1] > chunks[-1]["end"]):
+            chunks.append(_chunk(text, window[0][0], window[-1][1], window_tokens))
+        return chunks
+
+
+class FixedChunker(Chunker):
+    """The original fixed-width character slicer, kept as a baseline."""
+
+    name = "fixed"
+
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP, size: int = LEGACY_CHUNK_CHARS):
+        super().__init__(max_tokens, overlap)
+        self.size = size
+
+    def split(self, text: str):
+        return [_chunk(text, i, min(i + self.size, len(text))) for i in range(0, len(text), self.size)]
+
+
+class SentenceChunker(Chunker):
+    """Packs whole sentences and paragraphs into the token budget."""
+
+    name = "sentence"
+
+    def split(self, text: str):
+        units = [(s, e, count_tokens(text[s:e]), False) for s, e in _sentence_spans(text)]
+        return self._pack(text, units)
+
+
+class MarkdownChunker(Chunker):
+    """Keeps fenced code blocks and tables whole and starts a new chunk at each heading."""
+
+    name = "markdown"
+
+    def split(self, text: str):
+        units = []
+        for kind, start, end in self._blocks(text):
+            if kind == "prose":
+                spans = _sentence_spans(text, start, end)
+            else:
+                # Code and tables stay intact if they fit, otherwise break between lines
+                spans = [(start, end)] if count_tokens(text[start:end]) <= self.max_tokens else _line_spans(text, start, end)
+            for i, (s, e) in enumerate(spans):
+                units.append((s, e, count_tokens(text[s:e]), kind == "heading" and i == 0))
+        return self._pack(text, units)
+
+    @staticmethod
+    def _blocks(text):
+        """Yields (kind, start, end) for heading, code, table and prose blocks."""
+        blocks = []
+        kind, start = None, 0
+        in_fence = False
+        pos = 0
+        for line in text.splitlines(keepends=True):
+            if in_fence:
+                if _FENCE_RE.match(line):
+                    in_fence = False
+                    blocks.append(("code", start, pos + len(line)))
+                    kind = None
+                pos += len(line)
+                continue
+            if _FENCE_RE.match(line):
+                line_kind = "code"
+            elif _HEADING_RE.match(line):
+                line_kind = "heading"
+            elif _TABLE_RE.match(line):
+                line_kind = "table"
+            else:
+                line_kind = "prose"
+            if line_kind != kind or line_kind in ("heading", "code"):
+                if kind is not None:
+                    blocks.append((kind, start, pos))
+                kind, start = line_kind, pos
+            if line_kind == "code":
+                in_fence = True
+            pos += len(line)
+        if kind is not None:
+            blocks.append((kind, start, pos))
+        return [b for b in blocks if text[b[1]:b[2]].strip()]
+
+
+class CodeChunker(Chunker):
+    """Source files: packs blank-line separated blocks (functions, classes) and only splits them between lines."""
+
+    name = "code"
+
+    def split(self, text: str):
+        units = []
+        for start, end in _paragraph_spans(text):
+            tokens = count_tokens(text[start:end])
+            spans = [(start, end)] if tokens <= self.max_tokens else _line_spans(text, start, end)
+            units.extend((s, e, tokens if len(spans) == 1 else count_tokens(text[s:e]), False) for s, e in spans)
+        return self._pack(text, units)
+
+
+class PageChunker(SentenceChunker):
+    """For paged documents: a page that fits the budget is one chunk, longer pages split by sentence."""
+
+    name = "page"
+
+    def split(self, text: str):
+        stripped = text.strip()
+        if not stripped:
+            return []
+        tokens = count_tokens(text)
+        if tokens <= self.max_tokens:
+            start = text.index(stripped[0])
+            return [_chunk(text, start, start + len(stripped), tokens)]
+        return super().split(text)
+
+
+CHUNKERS = {c.name: c for c in (FixedChunker, SentenceChunker, MarkdownChunker, CodeChunker, PageChunker)}
+
+
+def get_chunker(name: str, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> Chunker:
+    try:
+        return CHUNKERS[name](max_tokens=max_tokens, overlap=overlap)
+    except KeyError:
+        raise ValueError(f"Unknown chunking strategy '{name}'. Choose from: {', '.join(CHUNKERS)}")
+
+
+def chunker_for(filename: str, mime_type: str = None) -> Chunker:
+    """Picks a strategy from CHUNK_STRATEGY, or by file type when it is 'auto'."""
+    if CHUNK_STRATEGY != "auto":
+        return get_chunker(CHUNK_STRATEGY)
+    lower = (filename or "").lower()
+    if lower.endswith(".pdf"):
+        return get_chunker("page")
+    if lower.endswith(MARKDOWN_EXTENSIONS):
+        return get_chunker("markdown")
+    if lower.endswith(CODE_EXTENSIONS):
+        return get_chunker("code")
+    return get_chunker("sentence")
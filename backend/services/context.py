@@ -0,0 +1,72 @@
+import os
+import re
+from services.chunking import count_tokens, _sentence_spans
+
+# Most estimated tokens of document context put into the answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Chunks whose word-shingle Jaccard similarity with an already chosen chunk is at least this are dropped
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+SHINGLE_WORDS = 5
+# A chunk is only trimmed to fit if at least this many tokens of budget are left
+MIN_TRIMMED_TOKENS = 40
+SEPARATOR = "\n"
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _trim_to_sentences(text: str, budget: int):
+    """Longest prefix of whole sentences that fits in budget tokens, or "" if not even one does."""
+    kept_end = 0
+    for start, end in _sentence_spans(text):
+        if count_tokens(text[:end]) > budget:
+            break
+        kept_end = end
+    return text[:kept_end]
+
+
+def assemble_context(hits, budget: int = CONTEXT_TOKEN_BUDGET, max_chunks: int = None,
+                     threshold: float = CONTEXT_DEDUP_THRESHOLD):
+    """Packs retrieved hits, best first, into at most `budget` tokens of prompt context.
+
+    Near-duplicates of a chunk already chosen are skipped, and the last chunk that doesn't fit
+    whole is cut at a sentence boundary. Returns (context, used_hits, tokens).
+    """
+    chosen, chosen_shingles, parts = [], [], []
+    used = 0
+    separator_tokens = count_tokens(SEPARATOR)
+    for hit in hits:
+        if max_chunks is not None and len(chosen) >= max_chunks:
+            break
+        text = (hit.get("document") or "").strip()
+        if not text:
+            continue
+        hit_shingles = shingles(text)
+        if any(jaccard(hit_shingles, s) >= threshold for s in chosen_shingles):
+            continue
+        remaining = budget - used - (separator_tokens if parts else 0)
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            if remaining < MIN_TRIMMED_TOKENS:
+                break
+            text = _trim_to_sentences(text, remaining)
+            if not text:
+                continue
+            tokens = count_tokens(text)
+        used += tokens + (separator_tokens if parts else 0)
+        parts.append(text)
+        chosen.append(hit)
+        chosen_shingles.append(hit_shingles)
+    return SEPARATOR.join(parts), chosen, used
@@ -0,0 +1,89 @@
+import os
+import time
+import asyncio
+
+# End-to-end time budgets (seconds) for a chat turn and for ingesting one upload
+CHAT_BUDGET_SECONDS = float(os.getenv("CHAT_BUDGET_SECONDS", "30"))
+UPLOAD_BUDGET_SECONDS = float(os.getenv("UPLOAD_BUDGET_SECONDS", "600"))
+
+# Most of the total budget a single stage may use, e.g. STAGE_SHARES="images=0.3,retrieval=0.2"
+DEFAULT_STAGE_SHARES = {
+    "retrieval": 0.25,
+    "vector": 0.2,
+    "images": 0.5,
+    "rerank": 0.05,
+    "completion": 1.0,
+    "vision": 0.3,
+    "ingest": 1.0,
+}
+# Below this much remaining time, optional stages are not started at all
+MIN_STAGE_SECONDS = float(os.getenv("MIN_STAGE_SECONDS", "0.5"))
+
+
+def _parse_shares(raw):
+    shares = dict(DEFAULT_STAGE_SHARES)
+    for item in filter(None, (raw or "").split(",")):
+        stage, _, value = item.partition("=")
+        shares[stage.strip()] = float(value)
+    return shares
+
+
+STAGE_SHARES = _parse_shares(os.getenv("STAGE_SHARES"))
+
+
+class DeadlineExceeded(Exception):
+    """An essential stage ran out of time."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Time budget exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """A per-request time budget passed down through every stage of a pipeline.
+
+    Each stage gets at most its configured share of the budget, capped by what is left. Optional
+    stages that run out of time are dropped and listed in `skipped`.
+    """
+
+    def __init__(self, budget: float, shares: dict = None):
+        self.budget = budget
+        self.shares = shares or STAGE_SHARES
+        self.expires_at = time.monotonic() + budget
+        self.skipped = []
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout_for(self, stage: str) -> float:
+        return min(self.remaining(), self.budget * self.shares.get(stage, 1.0))
+
+    def skip(self, stage: str):
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+    async def run(self, stage: str, awaitable, essential: bool = True, default=None):
+        """Awaits a stage within its time slice.
+
+        On timeout an essential stage raises DeadlineExceeded; an optional one returns `default`.
+        """
+        timeout = self.timeout_for(stage)
+        if not essential and timeout < MIN_STAGE_SECONDS:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            else:
+                asyncio.ensure_future(awaitable).cancel()
+            self.skip(stage)
+            return default
+        try:
+            return await asyncio.wait_for(awaitable, timeout=timeout)
+        except asyncio.TimeoutError:
+            if essential:
+                raise DeadlineExceeded(stage)
+            print(f"Skipping {stage}: exceeded its {timeout:.1f}s time slice")
+            self.skip(stage)
+            return default
@@ -0,0 +1,83 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import database as db
+
+DEFINITION_CACHE_SIZE = int(os.getenv("DEFINITION_CACHE_SIZE", "4096"))
+DEFINITION_TTL_SECONDS = int(os.getenv("DEFINITION_TTL_SECONDS", str(7 * 24 * 3600)))
+# Keep definitions in lumina_chat.db too, so they survive restarts and are shared between workers
+DEFINITION_CACHE_PERSIST = os.getenv("DEFINITION_CACHE_PERSIST", "1") == "1"
+
+_WORD_EDGE_RE = re.compile(r"^\W+|\W+$")
+_SPACE_RE = re.compile(r"\s+")
+_CONTEXT_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_word(word: str) -> str:
+    return _SPACE_RE.sub(" ", _WORD_EDGE_RE.sub("", word.strip())).casefold()
+
+
+def context_fingerprint(context: str) -> str:
+    """Stable hash of the context's words, so whitespace and case changes map to the same entry."""
+    words = _CONTEXT_WORD_RE.findall((context or "").casefold())
+    return hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()[:16] if words else ""
+
+
+def definition_key(word: str, context: str = "") -> str:
+    return f"{normalize_word(word)}\0{context_fingerprint(context)}"
+
+
+class DefinitionCache:
+    """In-process LRU with a TTL, backed by the definitions table when DEFINITION_CACHE_PERSIST is on."""
+
+    def __init__(self, max_entries: int = DEFINITION_CACHE_SIZE, ttl: int = DEFINITION_TTL_SECONDS,
+                 persist: bool = DEFINITION_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self._entries = OrderedDict()  # key -> (definition, expires_at)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """Returns {key: definition} for keys held in memory and not expired. Never blocks on I/O."""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+        return found
+
+    def load(self, keys):
+        """Blocking: fetches keys from the persistent layer into memory; returns {key: definition}."""
+        if not self.persist or not keys:
+            return {}
+        rows = db.get_definitions(keys, time.time() - self.ttl)
+        # Expire when the stored row would, not a full TTL after loading it
+        self._remember((key, definition, created_at) for key, (definition, created_at) in rows.items())
+        return {key: definition for key, (definition, _) in rows.items()}
+
+    def put_many(self, items):
+        """Blocking when persistent: stores (key, word, definition) triples."""
+        now = time.time()
+        self._remember((key, definition, now) for key, _, definition in items)
+        if self.persist and items:
+            db.save_definitions([(key, word, definition, now) for key, word, definition in items])
+
+    def _remember(self, entries):
+        """Stores (key, definition, created_at) entries; each expires `ttl` seconds after it was created."""
+        with self._lock:
+            for key, definition, created_at in entries:
+                self._entries[key] = (definition, created_at + self.ttl)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
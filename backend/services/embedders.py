@@ -0,0 +1,94 @@
+import os
+import re
+import hashlib
+
+# Which embedder RAGService uses for both ingestion and queries: "gemini", "hashing" or "onnx"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini")
+HASH_EMBED_DIM = int(os.getenv("HASH_EMBED_DIM", "1024"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class Embedder:
+    """Turns texts into vectors. embed() is blocking and is called from the executor pools."""
+
+    name = "base"          # Stable id, also used as the embedding cache key
+    dimension = 0
+    max_batch_size = 1     # Most texts accepted by one embed() call
+    provider = None        # services.upstream provider whose quota embed() counts against
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+
+class GeminiEmbedder(Embedder):
+    name = "models/gemini-embedding-001"
+    dimension = 3072
+    max_batch_size = 100
+    provider = "gemini"
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed(self, texts):
+        res = self.client.models.embed_content(model=self.name, contents=list(texts))
+        return [e.values for e in res.embeddings]
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic, CPU-only feature-hashing vectorizer over words and word bigrams.
+
+    No model files and no network; good for offline test rigs and as a lexical fallback.
+    """
+
+    max_batch_size = 512
+
+    def __init__(self, dimension: int = HASH_EMBED_DIM):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def _features(self, text):
+        words = _WORD_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        import numpy as np  # Deferred so importing the app doesn't load numpy
+        out = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                h = int.from_bytes(digest, "little")
+                out[row, h % self.dimension] += 1.0 if (h >> 63) & 1 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (out / norms).tolist()
+
+
+class OnnxMiniLMEmbedder(Embedder):
+    """all-MiniLM-L6-v2 run locally through the ONNX runtime that ships with chromadb.
+
+    The model is downloaded to the chromadb cache on first use; afterwards it runs fully offline.
+    """
+
+    name = "onnx-all-MiniLM-L6-v2"
+    dimension = 384
+    max_batch_size = 32
+
+    def __init__(self):
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        self._model = ONNXMiniLM_L6_V2()
+
+    def embed(self, texts):
+        import numpy as np
+        return [np.asarray(v, dtype=np.float32).tolist() for v in self._model(list(texts))]
+
+
+def get_embedder(backend: str = None, google_client=None) -> Embedder:
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "gemini":
+        return GeminiEmbedder(google_client)
+    if backend == "hashing":
+        return HashingEmbedder()
+    if backend == "onnx":
+        return OnnxMiniLMEmbedder()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Choose from: gemini, hashing, onnx")
@@ -0,0 +1,102 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Blocking SDK calls (Gemini, Groq, Chroma, DDGS, urllib) run on dedicated thread pools so
+# they never stall the event loop, and a flood of one kind of call can't starve the others.
+POOL_SIZES = {
+    "embed": int(os.getenv("EMBED_POOL_SIZE", "8")),
+    # Background ingestion gets its own pool so a burst of uploads can't starve /chat
+    "ingest": int(os.getenv("INGEST_POOL_SIZE", "8")),
+    "llm": int(os.getenv("LLM_POOL_SIZE", "16")),
+    "vector": int(os.getenv("VECTOR_POOL_SIZE", "4")),
+    "search": int(os.getenv("SEARCH_POOL_SIZE", "8")),
+    "vision": int(os.getenv("VISION_POOL_SIZE", "4")),
+    "io": int(os.getenv("IO_POOL_SIZE", "8")),
+    # Garbage collection runs one pass at a time, off the pool chat vector queries use
+    "gc": 1,
+}
+
+# CPU-bound work (PDF text extraction) goes to processes instead, sized to the host
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", str(min(os.cpu_count() or 1, 4))))
+
+# Items a blocking iterator may run ahead of its consumer before its thread waits
+ITERATE_BUFFER_SIZE = int(os.getenv("ITERATE_BUFFER_SIZE", "8"))
+
+_pools = {}
+_process_pool = None
+
+
+def get_pool(name: str) -> ThreadPoolExecutor:
+    pool = _pools.get(name)
+    if pool is None:
+        pool = ThreadPoolExecutor(max_workers=POOL_SIZES[name], thread_name_prefix=f"lumina-{name}")
+        _pools[name] = pool
+    return pool
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE)
+    return _process_pool
+
+
+async def run_blocking(pool_name: str, fn, *args, **kwargs):
+    """Runs a blocking callable on the named pool and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(pool_name), functools.partial(fn, *args, **kwargs))
+
+
+async def iterate_blocking(pool_name: str, make_iter, *args, **kwargs):
+    """Consumes a blocking iterator (e.g. an SDK stream) on the named pool, yielding items as they arrive.
+
+    At most ITERATE_BUFFER_SIZE items are buffered; past that the producing thread waits for the
+    consumer, so a slow consumer applies backpressure instead of the whole iterator being read ahead.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(ITERATE_BUFFER_SIZE)
+    done = object()
+    cancelled = False
+
+    def produce():
+        try:
+            for item in make_iter(*args, **kwargs):
+                slots.acquire()
+                if cancelled:
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(get_pool(pool_name), produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            slots.release()
+            yield item
+    finally:
+        cancelled = True
+        # Wakes a producer waiting for room so its thread can see the cancellation and exit
+        slots.release()
+        if producer.done():
+            producer.result()
+
+
+def shutdown_pools():
+    global _process_pool
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    _pools.clear()
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
@@ -0,0 +1,224 @@
+import os
+import time
+import uuid
+import hashlib
+import asyncio
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from services.executors import run_blocking
+from services import metrics
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "32"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+# Uploads past this size spool to a temp file on disk instead of memory
+SPOOL_MAX_MEMORY = int(os.getenv("UPLOAD_SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+# Largest single upload, and most upload bytes accepted but not yet ingested across all jobs
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+MAX_INFLIGHT_UPLOAD_BYTES = int(os.getenv("MAX_INFLIGHT_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+COPY_BLOCK_BYTES = 1024 * 1024
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue is at INGEST_QUEUE_DEPTH or MAX_INFLIGHT_UPLOAD_BYTES."""
+
+
+class UploadTooLargeError(Exception):
+    """Raised when a single upload is over MAX_UPLOAD_BYTES."""
+
+
+class SpooledUpload:
+    """Detached copy of an UploadFile that outlives the request, with the same read/seek surface."""
+
+    def __init__(self, filename: str, fileobj, size: int = 0, fingerprint: str = None):
+        self.filename = filename
+        self.file = fileobj
+        self.size = size
+        # sha256 of the content, taken while spooling; identifies repeat uploads of the same file
+        self.fingerprint = fingerprint
+
+    @classmethod
+    async def from_upload(cls, upload, max_bytes: int = MAX_UPLOAD_BYTES):
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        await upload.seek(0)
+        try:
+            size, fingerprint = await run_blocking("io", _copy_limited, upload.file, spool, max_bytes)
+        except UploadTooLargeError:
+            spool.close()
+            raise
+        spool.seek(0)
+        return cls(upload.filename, spool, size, fingerprint)
+
+    async def read(self, size: int = -1):
+        return self.file.read(size)
+
+    async def seek(self, offset: int):
+        self.file.seek(offset)
+
+    def close(self):
+        self.file.close()
+
+
+def _copy_limited(src, dst, max_bytes):
+    """Copies src to dst block by block; returns (size, sha256 hex digest)."""
+    size = 0
+    digest = hashlib.sha256()
+    while True:
+        block = src.read(COPY_BLOCK_BYTES)
+        if not block:
+            return size, digest.hexdigest()
+        size += len(block)
+        if size > max_bytes:
+            raise UploadTooLargeError(f"Upload is larger than the {max_bytes} byte limit")
+        digest.update(block)
+        dst.write(block)
+
+
+def file_fingerprint(fileobj):
+    """sha256 hex digest of a seekable file's whole content."""
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(COPY_BLOCK_BYTES), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class IngestJob:
+    def __init__(self, filename: str, session_id: str):
+        self.id = str(uuid.uuid4())
+        self.filename = filename
+        self.session_id = session_id
+        self.status = "queued"
+        self.pages_parsed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.failures = []
+        self.error = None
+        # "duplicate" (already in the session) or "shared" (chunks reused from another session)
+        self.deduplicated = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "session_id": self.session_id,
+            "status": self.status,
+            "pages_parsed": self.pages_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "failures": self.failures,
+            "error": self.error,
+            "deduplicated": self.deduplicated,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestQueue:
+    """Bounded queue of uploads processed by a fixed pool of worker tasks."""
+
+    def __init__(self, process, workers: int = INGEST_WORKERS, max_depth: int = INGEST_QUEUE_DEPTH,
+                 max_bytes: int = MAX_INFLIGHT_UPLOAD_BYTES):
+        # process(upload, session_id, job) is awaited for each job
+        self._process = process
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.bytes_in_flight = 0
+        self._queue = asyncio.Queue(maxsize=max_depth)
+        self._jobs = OrderedDict()
+        self._tasks = []
+        self._running = 0
+        # Cleared while paused: workers hold on to the next job until it's set again
+        self._resume = asyncio.Event()
+        self._resume.set()
+
+    def has_room_for(self, size: int) -> bool:
+        return self.bytes_in_flight + size <= self.max_bytes
+
+    def submit(self, upload, session_id: str) -> IngestJob:
+        self._ensure_workers()
+        size = getattr(upload, "size", 0)
+        if not self.has_room_for(size):
+            raise QueueFullError(f"Too many upload bytes waiting to be ingested (limit {self.max_bytes} bytes)")
+        job = IngestJob(upload.filename, session_id)
+        try:
+            self._queue.put_nowait((job, upload))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Ingestion queue is full ({self._queue.maxsize} pending uploads)")
+        # Reserved until the job finishes and its spool file is released
+        self.bytes_in_flight += size
+        self._jobs[job.id] = job
+        self._prune()
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def running(self):
+        return self._running
+
+    @asynccontextmanager
+    async def paused(self):
+        """Stops workers from starting new jobs inside the block; jobs already running carry on."""
+        self._resume.clear()
+        try:
+            yield
+        finally:
+            self._resume.set()
+
+    def start(self):
+        """Starts the workers up front, outside any request's context."""
+        self._ensure_workers()
+
+    def _ensure_workers(self):
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        # A worker outlives the request that may have started it; its spans belong to no response
+        metrics.end_request_timing()
+        while True:
+            job, upload = await self._queue.get()
+            await self._resume.wait()
+            self._running += 1
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                await self._process(upload, job.session_id, job)
+                job.status = "completed"
+            except Exception as e:
+                print(f"Ingestion job {job.id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                self._running -= 1
+                job.finished_at = time.time()
+                upload.close()
+                self.bytes_in_flight -= getattr(upload, "size", 0)
+                self._queue.task_done()
+
+    def _prune(self):
+        # Forget the oldest finished jobs once history is over the limit
+        excess = len(self._jobs) - INGEST_JOB_HISTORY
+        for job_id in [j.id for j in self._jobs.values() if j.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
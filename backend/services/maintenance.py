@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import asyncio
+import database as db
+from services.executors import run_blocking
+from services.definition_cache import DEFINITION_TTL_SECONDS
+
+# Periodic garbage collection; 0 disables the background loop (POST /maintenance/gc still works)
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "0"))
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "500"))
+
+_UUID_DIR_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+_gc_lock = asyncio.Lock()
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _drop_orphan_collections(rag_service, collections, live_ids, live_files):
+    dropped = 0
+    for collection in collections:
+        metadata = collection.metadata or {}
+        session_id = metadata.get("session_id")
+        fingerprint = metadata.get("fingerprint")
+        if session_id and session_id not in live_ids:
+            rag_service.chroma_client.delete_collection(name=collection.name)
+            # Also forgets any cached handle for the session
+            rag_service.delete_session_vectors(session_id)
+            dropped += 1
+        elif fingerprint and fingerprint not in live_files:
+            rag_service.delete_file_vectors([fingerprint])
+            dropped += 1
+    return dropped
+
+
+def _drop_orphan_legacy_chunks(collection, live_ids):
+    """Pages through the shared collection's metadata and deletes chunks of deleted sessions in batches."""
+    removed = 0
+    offset = 0
+    while True:
+        page = collection.get(limit=GC_BATCH_SIZE, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            break
+        orphans = [i for i, m in zip(page["ids"], page["metadatas"]) if (m or {}).get("session_id") not in live_ids]
+        if orphans:
+            collection.delete(ids=orphans)
+            removed += len(orphans)
+        # Deleted rows shift the remaining ones down, so only advance past the rows that stayed
+        offset += len(page["ids"]) - len(orphans)
+    return removed
+
+
+def _compact(chroma_path):
+    """VACUUMs Chroma's SQLite store and removes segment directories no segment row refers to."""
+    sqlite_path = os.path.join(chroma_path, "chroma.sqlite3")
+    if not os.path.exists(sqlite_path):
+        return 0
+    # Directories are listed before segments are read. Session deletes can still create or drop collections,
+    # but Chroma writes a segment row before its directory, so any directory listed here already has its row if it's live
+    candidates = [
+        name for name in os.listdir(chroma_path)
+        if _UUID_DIR_RE.match(name) and os.path.isdir(os.path.join(chroma_path, name))
+    ]
+    conn = sqlite3.connect(sqlite_path, timeout=30)
+    try:
+        conn.execute("VACUUM")
+        live_segments = {r[0] for r in conn.execute("SELECT id FROM segments")}
+    finally:
+        conn.close()
+    removed = 0
+    for name in candidates:
+        if name not in live_segments:
+            shutil.rmtree(os.path.join(chroma_path, name), ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def collect_garbage(rag_service):
+    """Deletes vectors and keyword rows left behind by deleted sessions and files; returns the counts."""
+    # List collections before reading sessions: any session owning a listed collection is then visible,
+    # so a session created mid-run can't be mistaken for an orphan
+    collections = rag_service.chroma_client.list_collections()
+    live_ids = db.get_session_ids()
+    # Files referenced only by deleted sessions are released first, so their collections count as orphans
+    released_files = db.release_orphan_files()
+    live_files = db.get_file_fingerprints()
+    return {
+        "released_files": len(released_files),
+        "orphan_collections": _drop_orphan_collections(rag_service, collections, live_ids, live_files),
+        "orphan_chunks": _drop_orphan_legacy_chunks(rag_service.collection, live_ids),
+        "orphan_keyword_rows": db.delete_orphan_chunks(),
+        "expired_definitions": db.delete_expired_definitions(time.time() - DEFINITION_TTL_SECONDS),
+    }
+
+
+async def run(rag_service, ingest_queue):
+    """Collects garbage on the gc pool, then compacts ./chroma_db if no ingest job is writing to it.
+
+    VACUUM holds an exclusive lock on chroma.sqlite3 for the whole rewrite, so ingestion is paused
+    around it and compaction is skipped while jobs are already running. Returns a report with
+    counts, bytes reclaimed and time taken, or {"status": "busy"} if a run is in progress.
+    """
+    if _gc_lock.locked():
+        return {"status": "busy"}
+    async with _gc_lock:
+        started = time.perf_counter()
+        chroma_path = os.path.abspath(rag_service.chroma_path)
+        bytes_before = await run_blocking("gc", _dir_size, chroma_path)
+        report = {"status": "ok"}
+        report.update(await run_blocking("gc", collect_garbage, rag_service))
+
+        async with ingest_queue.paused():
+            running = ingest_queue.running()
+            if running:
+                print(f"Chroma compaction skipped: {running} ingest jobs running")
+                report["compacted"] = False
+                report["compaction_skipped"] = f"{running} ingest jobs running"
+            else:
+                try:
+                    report["orphan_segment_dirs"] = await run_blocking("gc", _compact, chroma_path)
+                    report["compacted"] = True
+                except Exception as e:
+                    print(f"Chroma compaction skipped: {e}")
+                    report["compacted"] = False
+                    report["compaction_skipped"] = str(e)
+
+        bytes_after = await run_blocking("gc", _dir_size, chroma_path)
+        report.update({
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "bytes_reclaimed": max(bytes_before - bytes_after, 0),
+            "seconds": round(time.perf_counter() - started, 3),
+        })
+        print(f"Maintenance finished: {report}")
+        return report
+
+
+async def run_periodically(rag_service, ingest_queue, interval: int = MAINTENANCE_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run(rag_service, ingest_queue)
+        except Exception as e:
+            print(f"Maintenance run failed: {e}")
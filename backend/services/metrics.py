@@ -0,0 +1,187 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Adds a Server-Timing header (per-stage durations) to every response when set to 1
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+_registry = []
+# Stage durations recorded while handling the current request, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [cumulative bucket counts, sum, count]
+            series = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {n}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("lumina_stage_seconds", "Time spent in each pipeline stage.", ["stage"])
+STAGE_ERRORS = Counter("lumina_stage_errors_total", "Stages that raised instead of finishing.", ["stage"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "lumina_http_request_seconds", "HTTP request latency by route.", ["method", "route", "status"]
+)
+UPSTREAM_ERRORS = Counter("lumina_upstream_errors_total", "Failed provider calls.", ["provider", "status"])
+UPSTREAM_RETRIES = Counter("lumina_upstream_retries_total", "Provider calls retried after a failure.", ["provider"])
+UPSTREAM_CONCURRENCY = Gauge("lumina_upstream_concurrency_limit", "Current adaptive concurrency limit.", ["provider"])
+UPSTREAM_IN_FLIGHT = Gauge("lumina_upstream_in_flight", "Provider calls currently in flight.", ["provider"])
+CACHE_LOOKUPS = Counter("lumina_cache_lookups_total", "Cache lookups by cache and result.", ["cache", "result"])
+CHUNKS_INGESTED = Counter("lumina_chunks_ingested_total", "Chunks embedded and stored.", ["chunker"])
+CHUNKS_RETRIEVED = Histogram("lumina_chunks_retrieved", "Chunks put into each answer prompt.", buckets=COUNT_BUCKETS)
+CONTEXT_TOKENS = Histogram("lumina_context_tokens", "Estimated context tokens per answer prompt.", buckets=COUNT_BUCKETS)
+INGEST_QUEUE_DEPTH = Gauge("lumina_ingest_queue_depth", "Uploads waiting for an ingest worker.")
+INGEST_BYTES_IN_FLIGHT = Gauge("lumina_ingest_bytes_in_flight", "Upload bytes accepted but not yet ingested.")
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """Times the block as one occurrence of `stage` (also across awaits)."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+async def timed(stage: str, awaitable):
+    """Awaits `awaitable` inside span(stage); handy for tasks and gather() arguments."""
+    with span(stage):
+        return await awaitable
+
+
+def count_cache(cache: str, hits: int, misses: int):
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache, result="miss")
+
+
+def start_request_timing():
+    """Starts collecting stage timings for the current request; returns the list and a token for end_request_timing."""
+    timings = []
+    return timings, _request_timings.set(timings)
+
+
+def end_request_timing(token=None):
+    """Stops collecting: restores the context from `token`, or detaches it when there is none.
+
+    Long-lived tasks started while handling a request (e.g. ingest workers) inherit its list, so
+    they call this without a token to stop appending to a response that was sent long ago.
+    """
+    if token is None:
+        _request_timings.set(None)
+    else:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings):
+    """Server-Timing value: total milliseconds and occurrences per stage, in first-seen order."""
+    totals = {}
+    for stage, seconds in timings:
+        total, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + seconds, count + 1)
+    return ", ".join(
+        f'{stage};dur={total * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+        for stage, (total, count) in totals.items()
+    )
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,198 +1,876 @@
 import os
-import uuid
+import re
+import json
+import time
+import hashlib
+import threading
+import asyncio
 import mimetypes
-from google import genai
-from groq import Groq
-from duckduckgo_search import DDGS
-from pypdf import PdfReader
-import chromadb
 from dotenv import load_dotenv
+import database as db
+from services.executors import run_blocking, iterate_blocking
+from services.embedding_cache import EmbeddingCache
+from services.embedders import get_embedder, EMBEDDING_BACKEND
+from services.pdf_extract import iter_pdf_pages
+from services.text_extract import iter_text_segments
+from services.chunking import chunker_for
+from services.context import assemble_context
+from services.rerank import rerank_hits, RERANK_CANDIDATES
+from services.definition_cache import DefinitionCache, definition_key
+from services.deadline import Deadline, CHAT_BUDGET_SECONDS, UPLOAD_BUDGET_SECONDS
+from services import upstream
+from services.vision import describe_image
+from services.ingest_queue import file_fingerprint
+from services.metrics import span, timed, observe_stage, count_cache, CHUNKS_INGESTED, CHUNKS_RETRIEVED, CONTEXT_TOKENS
 
 load_dotenv()
 
 import logging
 logger = logging.getLogger("lumina")
 
+COLLECTION_NAME = "lumina_notebook"
+CHROMA_PATH = "./chroma_db"
+# Chunks sent per embed_content call, and how many of those calls may be in flight at once
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+# "hybrid" fuses keyword (FTS5/BM25) and vector results; "keyword" skips the embedding call entirely
+# and "vector" skips the keyword index
+RETRIEVAL_MODES = ("hybrid", "keyword", "vector")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+    raise ValueError(f"Unknown RETRIEVAL_MODE '{RETRIEVAL_MODE}'. Choose from: {', '.join(RETRIEVAL_MODES)}")
+RETRIEVAL_TOP_K = 4
+RRF_K = 60
+# How often an upload waits to re-check a file another upload is still ingesting
+SHARED_INGEST_POLL_SECONDS = 1.0
+# Terms defined per Groq call by define_words
+DEFINE_BATCH_SIZE = int(os.getenv("DEFINE_BATCH_SIZE", "40"))
+
 class RAGService:
     def __init__(self):
-        # Professional Client Initialization
-        self.google_client = genai.Client(api_key=os.getenv("GOOGLE_GENERATIVE_AI_API_KEY"))
-        # Increase timeout to 60s for handling complex reasoning
-        self.groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"), timeout=60.0)
-        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
-        self.collection = self.chroma_client.get_or_create_collection(name="lumina_notebook")
-
-    async def process_file(self, file, session_id: str):
-        """Intelligently processes PDF, Text, Code, or Images."""
+        # SDK clients, the embedder, Chroma and the embedding cache are built on first use (or by
+        # warmup), so importing this module doesn't pull in chromadb/google-genai/groq or need API keys
+        self._google_client = None
+        self._groq_client = None
+        self._embedder = None
+        self._chroma_client = None
+        self._collection = None
+        self._embedding_cache = None
+        self._init_lock = threading.RLock()
+        self.chroma_path = CHROMA_PATH
+        self._legacy_pending = True
+        self._session_collections = {}
+        self._file_collections = {}
+        self._collections_lock = threading.Lock()
+        self.definition_cache = DefinitionCache()
+
+    def _lazy(self, attr: str, build):
+        value = getattr(self, attr)
+        if value is None:
+            with self._init_lock:
+                value = getattr(self, attr)
+                if value is None:
+                    value = build()
+                    setattr(self, attr, value)
+        return value
+
+    @property
+    def google_client(self):
+        def build():
+            from google import genai
+            # Professional Client Initialization
+            return genai.Client(api_key=os.getenv("GOOGLE_GENERATIVE_AI_API_KEY"))
+        return self._lazy("_google_client", build)
+
+    @property
+    def groq_client(self):
+        def build():
+            from groq import Groq
+            # Increase timeout to 60s for handling complex reasoning; retries are left to services.upstream
+            return Groq(api_key=os.getenv("GROQ_API_KEY"), timeout=60.0, max_retries=0)
+        return self._lazy("_groq_client", build)
+
+    @property
+    def embedder(self):
+        def build():
+            google_client = self.google_client if EMBEDDING_BACKEND == "gemini" else None
+            return get_embedder(EMBEDDING_BACKEND, google_client=google_client)
+        return self._lazy("_embedder", build)
+
+    @property
+    def chroma_client(self):
+        def build():
+            import chromadb
+            return chromadb.PersistentClient(path=self.chroma_path)
+        return self._lazy("_chroma_client", build)
+
+    @property
+    def collection_name(self):
+        return self._collection_name_for(self.embedder)
+
+    @property
+    def collection(self):
+        # Shared collection from before vectors were partitioned by session; drained by migrate_legacy_vectors
+        return self._lazy("_collection", self._open_collection)
+
+    @collection.setter
+    def collection(self, value):
+        self._collection = value
+
+    @property
+    def embedding_cache(self):
+        return self._lazy("_embedding_cache", EmbeddingCache)
+
+    def warmup(self):
+        """Builds every lazily created dependency now; returns seconds spent per component.
+
+        The Gemini client is only built when it is the embedding backend, and Groq only when a key is
+        set, so an offline setup (e.g. EMBEDDING_BACKEND=hashing, no keys) still becomes ready.
+        """
+        timings = {}
+        names = ["embedder", "chroma_client", "collection", "embedding_cache"]
+        if os.getenv("GROQ_API_KEY"):
+            names.insert(0, "groq_client")
+        if EMBEDDING_BACKEND == "gemini":
+            names.insert(0, "google_client")
+        for name in names:
+            started = time.perf_counter()
+            getattr(self, name)
+            timings[name] = round(time.perf_counter() - started, 3)
+        return timings
+
+    @staticmethod
+    def _collection_name_for(embedder):
+        # Vectors of different dimensionality can't share a collection, so non-default embedders get their own
+        if embedder.name == "models/gemini-embedding-001":
+            return COLLECTION_NAME
+        return f"{COLLECTION_NAME}_{re.sub(r'[^a-zA-Z0-9]+', '_', embedder.name).strip('_')}"
+
+    def _open_collection(self):
+        return self.chroma_client.get_or_create_collection(
+            name=self.collection_name,
+            metadata={"embedder": self.embedder.name, "dimension": self.embedder.dimension}
+        )
+
+    def _session_collection_name(self, session_id: str):
+        # Hashed so any session id maps to a valid Chroma collection name
+        return f"{self.collection_name}-s-{hashlib.sha1(session_id.encode('utf-8')).hexdigest()}"
+
+    def _session_collection(self, session_id: str, create: bool = True):
+        """Chunks migrated out of the legacy shared collection, per session.
+
+        Uploads go to per-file collections (_file_collection); this only holds chunks stored before
+        files were deduplicated, and is searched alongside the session's file collections.
+        """
+        with self._collections_lock:
+            collection = self._session_collections.get(session_id)
+            if collection is not None:
+                return collection
+            name = self._session_collection_name(session_id)
+            if create:
+                collection = self.chroma_client.get_or_create_collection(
+                    name=name,
+                    metadata={"session_id": session_id, "embedder": self.embedder.name, "dimension": self.embedder.dimension}
+                )
+            else:
+                try:
+                    collection = self.chroma_client.get_collection(name=name)
+                except Exception:
+                    return None
+            self._session_collections[session_id] = collection
+            return collection
+
+    def _file_collection_name(self, fingerprint: str):
+        return f"{self.collection_name}-f-{fingerprint[:40]}"
+
+    def _file_collection(self, fingerprint: str, create: bool = True):
+        """One collection per distinct uploaded file, referenced by every session that uploaded it."""
+        with self._collections_lock:
+            collection = self._file_collections.get(fingerprint)
+            if collection is not None:
+                return collection
+            name = self._file_collection_name(fingerprint)
+            if create:
+                collection = self.chroma_client.get_or_create_collection(
+                    name=name,
+                    metadata={"fingerprint": fingerprint, "embedder": self.embedder.name, "dimension": self.embedder.dimension}
+                )
+            else:
+                try:
+                    collection = self.chroma_client.get_collection(name=name)
+                except Exception:
+                    return None
+            self._file_collections[fingerprint] = collection
+            return collection
+
+    def _staging_collection_name(self, fingerprint: str):
+        return f"{self.collection_name}-r-{fingerprint[:40]}"
+
+    def _staging_collection(self, fingerprint: str):
+        """Where a degraded file is re-ingested; swapped in by promote_staged_file only once it succeeds."""
+        return self.chroma_client.get_or_create_collection(
+            name=self._staging_collection_name(fingerprint),
+            metadata={"fingerprint": fingerprint, "embedder": self.embedder.name, "dimension": self.embedder.dimension}
+        )
+
+    def promote_staged_file(self, fingerprint: str):
+        """Replaces a file's vectors and keyword rows with its staged re-ingest."""
+        staged = self.chroma_client.get_collection(name=self._staging_collection_name(fingerprint))
+        stored = staged.get(include=["documents", "metadatas"])
+        with self._collections_lock:
+            self._file_collections.pop(fingerprint, None)
+            try:
+                self.chroma_client.delete_collection(name=self._file_collection_name(fingerprint))
+            except Exception:
+                pass  # File had no chunks
+            staged.modify(name=self._file_collection_name(fingerprint))
+        db.replace_file_chunks(fingerprint, [
+            (i, (m or {}).get("session_id", ""), (m or {}).get("filename", ""), d, fingerprint)
+            for i, d, m in zip(stored["ids"], stored["documents"], stored["metadatas"])
+        ])
+
+    def delete_file_vectors(self, fingerprints):
+        """Drops the collections (and any staged re-ingest) of files no session references any more."""
+        for fingerprint in fingerprints:
+            with self._collections_lock:
+                self._file_collections.pop(fingerprint, None)
+            for name in (self._file_collection_name(fingerprint), self._staging_collection_name(fingerprint)):
+                try:
+                    self.chroma_client.delete_collection(name=name)
+                except Exception:
+                    pass  # File had no chunks
+
+    def delete_session_vectors(self, session_id: str):
+        """Drops the session's collection in one call instead of deleting its chunks one by one."""
+        with self._collections_lock:
+            self._session_collections.pop(session_id, None)
+        try:
+            self.chroma_client.delete_collection(name=self._session_collection_name(session_id))
+        except Exception:
+            pass  # Session never had any documents
+        if self._legacy_pending:
+            self.collection.delete(where={"session_id": session_id})
+
+    def migrate_legacy_vectors(self, batch_size: int = 500):
+        """Moves chunks from the shared pre-partitioning collection into their session collections."""
+        moved = 0
+        while True:
+            batch = self.collection.get(limit=batch_size, include=["embeddings", "documents", "metadatas"])
+            if not batch["ids"]:
+                break
+            by_session = {}
+            for i, chunk_id in enumerate(batch["ids"]):
+                sid = (batch["metadatas"][i] or {}).get("session_id")
+                by_session.setdefault(sid, []).append(i)
+            for sid, rows in by_session.items():
+                if sid:
+                    self._session_collection(sid).add(
+                        ids=[batch["ids"][i] for i in rows],
+                        embeddings=[batch["embeddings"][i] for i in rows],
+                        documents=[batch["documents"][i] for i in rows],
+                        metadatas=[batch["metadatas"][i] for i in rows]
+                    )
+            self.collection.delete(ids=batch["ids"])
+            moved += len(batch["ids"])
+        self._legacy_pending = False
+        if moved:
+            print(f"Moved {moved} legacy chunks into per-session collections")
+        return moved
+
+    async def process_file(self, file, session_id: str, job=None, deadline: Deadline = None):
+        """Intelligently processes PDF, Text, Code, or Images. Progress is reported on job, if given.
+
+        Content is identified by its sha256: a file the session already has is skipped, and one
+        another session already uploaded is shared by reference instead of being ingested again.
+        """
+        deadline = deadline or Deadline(UPLOAD_BUDGET_SECONDS)
+        fingerprint = getattr(file, "fingerprint", None) or await run_blocking("io", file_fingerprint, file.file)
+        async def register():
+            return await run_blocking(
+                "io", db.register_file, session_id, fingerprint, file.filename, getattr(file, "size", 0),
+                UPLOAD_BUDGET_SECONDS
+            )
+
+        registration = await register()
+        while registration == "pending":
+            # The same content is being ingested for another session; share its chunks once it's done
+            # rather than indexing them twice
+            if deadline.expired:
+                raise TimeoutError(f"{file.filename} is still being ingested by another upload")
+            await asyncio.sleep(min(SHARED_INGEST_POLL_SECONDS, deadline.remaining()))
+            registration = await register()
+        if registration not in ("new", "retry"):
+            print(f"Skipped ingesting {file.filename}: {'already in this session' if registration == 'duplicate' else 'reusing stored chunks'}")
+            if job:
+                job.deduplicated = registration
+            return
+        # An earlier upload was stored without its vision description. Sessions already use those
+        # chunks, so the retry is staged and only replaces them once it has fully succeeded
+        staging = registration == "retry"
+        try:
+            chunk_count, degraded = await self._ingest_file(file, fingerprint, job, deadline, staging)
+            if staging:
+                await run_blocking("vector", self.promote_staged_file, fingerprint)
+            await run_blocking("io", db.mark_file_ready, fingerprint, chunk_count, degraded)
+        except Exception:
+            if staging:
+                try:
+                    await run_blocking(
+                        "vector", self.chroma_client.delete_collection, name=self._staging_collection_name(fingerprint)
+                    )
+                except Exception:
+                    pass  # Nothing was staged
+            # Let the same upload be retried; chunks already stored are picked up again by id
+            await run_blocking(
+                "io", db.unregister_file, session_id, fingerprint, "degraded" if staging else "failed"
+            )
+            raise
+
+    async def _ingest_file(self, file, fingerprint: str, job=None, deadline: Deadline = None, staging: bool = False):
+        """Parses, chunks and embeds one file into its shared file collection (or its staging one).
+
+        Returns (chunk_count, degraded); degraded means vision failed and only a placeholder was stored.
+        """
         filename = file.filename
         mime_type, _ = mimetypes.guess_type(filename)
         content_to_embed = ""
+        degraded = False
+        pages = None
         
         # 1. Image Processing (OCR & Vision)
         if mime_type and mime_type.startswith('image'):
             try:
-                # Read image bytes
-                file.file.seek(0)
-                image_bytes = await file.read()
-                
-                # Direct HTTP Fallback for Vision Reliability
-                import json
-                import urllib.request
-                import base64
-
-                api_key = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY")
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-                
-                # Prepare JSON payload
-                image_b64 = base64.b64encode(image_bytes).decode('utf-8')
-                payload = {
-                    "contents": [{
-                        "parts": [
-                            {"inline_data": {"mime_type": mime_type, "data": image_b64}},
-                            {"text": "1. Transcribe ALL visible text in this image exactly as it appears. \n2. Describe the layout and visual elements in detail.\n\nOutput format:\nOCR TRANSCRIPTION:\n[Text here]\n\nVISUAL DESCRIPTION:\n[Description here]"}
-                        ]
-                    }]
-                }
-                
-                req = urllib.request.Request(
-                    url,
-                    data=json.dumps(payload).encode('utf-8'),
-                    headers={'Content-Type': 'application/json'}
+                # Downscaled and re-encoded before it is sent; vision is optional, so past its
+                # time slice the image is indexed by filename only
+                image_description = await deadline.run(
+                    "vision", describe_image(file.file, mime_type, deadline), essential=False
                 )
-                
-                try:
-                    with urllib.request.urlopen(req) as response:
-                        result = json.loads(response.read().decode())
-                        # Extract text from complex response structure
-                        image_description = result['candidates'][0]['content']['parts'][0]['text']
-                        print(f"Vision Success: {image_description[:50]}...")
-                except Exception as e:
-                    print(f"HTTP Vision Failed: {e}")
-                    image_description = f"[Image {file.filename}: Vision processing skipped due to error: {str(e)}]"
-                
+                if image_description is None:
+                    raise TimeoutError("vision time budget exceeded")
+                print(f"Vision Success: {image_description[:50]}...")
                 content_to_embed = f"Filename: {filename}\nImage Content (OCR/Vision):\n{image_description}"
-                
             except Exception as e:
                 print(f"Vision processing failed for {filename}: {e}")
+                if job:
+                    job.failures.append(f"vision: {e}")
                 content_to_embed = f"Image file: {filename}. (Vision processing skipped due to error)"
+                degraded = True
 
-        # 2. PDF Processing
+        # 2. PDF Processing (pages stream in and are chunked/embedded as they arrive)
         elif filename.lower().endswith('.pdf'):
-            reader = PdfReader(file.file)
-            content_to_embed = "".join([p.extract_text().replace("\x00", "") for p in reader.pages if p.extract_text()])
+            pages = iter_pdf_pages(file.file)
 
-        # 3. Text/Code Processing
+        # 3. Text/Code Processing (decoded and chunked a block at a time, never read whole)
         else:
-            content_to_embed = (await file.read()).decode("utf-8", errors="ignore")
+            pages = iter_text_segments(file.file)
+
+        if pages is None:
+            pages = self._single_page(content_to_embed) if content_to_embed else None
+
+        if pages is None:
+            return 0, degraded
+        try:
+            # Chunk and Embed (Using Google for Embeddings)
+            metadata = {"filename": filename, "type": mime_type or "text", "fingerprint": fingerprint}
+            chunker = chunker_for(filename, mime_type)
+            chunk_count = await deadline.run("ingest", self._ingest_pages(pages, chunker, metadata, job, staging))
+            print(f"Successfully processed and embedded: {filename} ({chunk_count} chunks, cache {self.embedding_cache.stats()})")
+            return chunk_count, degraded
+        except Exception as e:
+            print(f"Error embedding {filename}: {e}")
+            raise e
+
+    @staticmethod
+    async def _single_page(text: str):
+        yield None, text
+
+    async def _ingest_pages(self, pages, chunker, metadata, job=None, staging: bool = False):
+        """Chunks (page_number, text) pairs as they arrive and embeds them in batches.
+
+        Each batch is written with a single add. At most EMBED_CONCURRENCY batches are in flight;
+        beyond that, page extraction waits, so memory stays flat however long the document is.
+        When staging, only the staging collection is written; keyword rows follow on promotion.
+        """
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+        in_flight = set()
 
-        if content_to_embed:
+        async def embed_batch(batch):
             try:
-                # Chunk and Embed (Using Google for Embeddings)
-                chunks = [content_to_embed[i:i+1200] for i in range(0, len(content_to_embed), 1200)]
-                for chunk in chunks:
-                    res = self.google_client.models.embed_content(model="models/gemini-embedding-001", contents=chunk)
-                    self.collection.add(
-                        ids=[str(uuid.uuid4())],
-                        embeddings=[res.embeddings[0].values],
-                        documents=[chunk],
-                        metadatas=[{"filename": filename, "type": mime_type or "text", "session_id": session_id}]
+                ids = [self._chunk_id(text, meta) for text, meta in batch]
+                # Chunks already stored by an earlier, interrupted run of the same upload are not re-embedded
+                existing = set((await run_blocking("ingest", collection.get, ids=ids, include=[]))["ids"])
+                if existing:
+                    kept = [k for k, i in enumerate(ids) if i not in existing]
+                    if job:
+                        job.chunks_embedded += len(ids) - len(kept)
+                    ids = [ids[k] for k in kept]
+                    batch = [batch[k] for k in kept]
+                    if not batch:
+                        return
+                texts = [text for text, _ in batch]
+                embeddings = await self._embed_texts(texts, pool="ingest")
+                with span("vector_write"):
+                    await run_blocking(
+                        "ingest", collection.add,
+                        ids=ids,
+                        embeddings=embeddings,
+                        documents=texts,
+                        metadatas=[meta for _, meta in batch]
                     )
-                print(f"Successfully processed and embedded: {filename}")
+                if not staging:
+                    with span("db_write"):
+                        await run_blocking(
+                            "ingest", db.index_chunks,
+                            [
+                                (i, meta.get("session_id", ""), meta["filename"], text, meta.get("fingerprint", ""))
+                                for i, (text, meta) in zip(ids, batch)
+                            ]
+                        )
+                CHUNKS_INGESTED.inc(len(batch), chunker=chunker.name)
+                if job:
+                    job.chunks_embedded += len(batch)
             except Exception as e:
-                print(f"Error embedding {filename}: {e}")
-                raise e
+                if job:
+                    job.failures.append(f"embed: {e}")
+                raise
+            finally:
+                semaphore.release()
 
-    async def query(self, query: str, include_images: bool, session_id: str = None):
+        async def submit(batch):
+            await semaphore.acquire()
+            for task in [t for t in in_flight if t.done()]:
+                in_flight.discard(task)
+                task.result()  # surface a failed batch before extracting any further
+            in_flight.add(asyncio.create_task(embed_batch(batch)))
+
+        batch_size = min(EMBED_BATCH_SIZE, self.embedder.max_batch_size)
+        if staging:
+            collection = await run_blocking("vector", self._staging_collection, metadata["fingerprint"])
+        else:
+            collection = await run_blocking("vector", self._file_collection, metadata["fingerprint"])
+        chunk_count = 0
+        batch = []
+        # Segments of one text stream (page_number None) continue each other; page offsets restart per page
+        offset = 0
         try:
-            # 1. Context Retrieval (Using Google Embeddings)
-            q_res = self.google_client.models.embed_content(model="models/gemini-embedding-001", contents=query)
-            where_filter = {"session_id": session_id} if session_id else None
-            logger.info(f"DEBUG: Querying with session_id='{session_id}', where_filter={where_filter}")
-            docs = self.collection.query(
-                query_embeddings=[q_res.embeddings[0].values], 
-                n_results=4,
-                where=where_filter
-            )
-            logger.info(f"DEBUG: Retrieved docs metadata: {docs['metadatas']}")
-            context = "\n".join(docs['documents'][0]) if docs['documents'] else "No document context found."
+            async for page_number, text in pages:
+                if job and page_number:
+                    job.pages_parsed = page_number
+                base = 0 if page_number else offset
+                offset += 0 if page_number else len(text)
+                for chunk in chunker.split(text):
+                    chunk_meta = dict(
+                        metadata, chunker=chunker.name, start_offset=base + chunk["start"], end_offset=base + chunk["end"]
+                    )
+                    if page_number:
+                        chunk_meta["page"] = page_number
+                    batch.append((chunk["text"], chunk_meta))
+                    chunk_count += 1
+                    if job:
+                        job.chunks_total = chunk_count
+                    if len(batch) >= batch_size:
+                        await submit(batch)
+                        batch = []
+            if batch:
+                await submit(batch)
+            await asyncio.gather(*in_flight)
+        finally:
+            for task in in_flight:
+                task.cancel()
+        return chunk_count
 
-            # 2. Multimedia Search (Using Groq for reasoning-based query generation)
-            images = []
-            if include_images:
-                try:
-                    v_prompt = f"""
-                    You are an expert visual researcher. Generate 3 SPECIFIC image search queries based on:
-                    QUERY: {query}
-                    CONTEXT fragments: {context[:2000]}
-                    
-                    Format: exactly 3 lines, "Search Query | Why relevant".
-                    """
-                    
-                    # Groq (Llama 3.3) for smart search planning
-                    v_resp = self.groq_client.chat.completions.create(
-                        messages=[{"role": "user", "content": v_prompt}], 
-                        model="llama-3.3-70b-versatile",
-                        temperature=0.3
+    @staticmethod
+    def _chunk_id(text: str, meta: dict):
+        """Deterministic id, so a retried upload can tell which chunks are already stored."""
+        fields = ("fingerprint", "session_id", "filename", "page", "start_offset")
+        key = "\0".join(str(meta.get(k, "")) for k in fields) + "\0" + text
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    async def _embed_texts(self, texts, pool: str = "embed", deadline: Deadline = None):
+        """Embeds texts, serving repeats from the persistent cache and only sending misses to the embedder."""
+        model = self.embedder.name
+        vectors = await run_blocking("io", self.embedding_cache.get_many, model, texts)
+        missing = [i for i in range(len(texts)) if i not in vectors]
+        count_cache("embedding", len(texts) - len(missing), len(missing))
+        step = self.embedder.max_batch_size
+        for start in range(0, len(missing), step):
+            part = missing[start:start + step]
+            with span("embed"):
+                if self.embedder.provider:
+                    fresh = await upstream.call(
+                        self.embedder.provider, pool, self.embedder.embed, [texts[i] for i in part], deadline=deadline
                     )
-                    
-                    for line in v_resp.choices[0].message.content.strip().split('\n')[:3]:
-                        if "|" in line:
-                            q_text, c_label = line.split("|")
-                            with DDGS(timeout=10) as ddgs:
-                                res = list(ddgs.images(q_text.strip(), max_results=1))
-                                if res:
-                                    images.append({
-                                        "url": res[0]['image'], 
-                                        "thumbnail": res[0]['thumbnail'], 
-                                        "title": res[0]['title'],
-                                        "context_label": c_label.strip()
-                                    })
-                except Exception as img_err:
-                    print(f"Search failed: {img_err}")
-
-            # 3. Chat Response (Using Groq for superior language quality)
-            system_prompt = """You are Lumina AI. Use Markdown.
+                else:
+                    fresh = await run_blocking(pool, self.embedder.embed, [texts[i] for i in part])
+            vectors.update(zip(part, fresh))
+            await run_blocking("io", self.embedding_cache.put_many, model, [texts[i] for i in part], fresh)
+        return [vectors[i] for i in range(len(texts))]
+
+    @staticmethod
+    def _image_search(q_text: str, timeout: float = 10):
+        from duckduckgo_search import DDGS
+        with DDGS(timeout=max(min(timeout, 10), 1)) as ddgs:
+            return list(ddgs.images(q_text, max_results=1))
+
+    async def _retrieve_context(self, query: str, session_id: str = None, mode: str = None, deadline: Deadline = None):
+        """Keyword and vector retrieval run side by side and are merged with reciprocal-rank fusion.
+
+        In hybrid mode, if the embedding or vector path fails or runs out of time, the keyword results
+        are used on their own; "keyword" and "vector" modes only run their own path.
+        Returns (context, sources, context_tokens); the context is deduplicated and fits CONTEXT_TOKEN_BUDGET.
+        """
+        mode = mode or RETRIEVAL_MODE
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}'")
+        deadline = deadline or Deadline(CHAT_BUDGET_SECONDS)
+        keyword_task = None
+        if mode != "vector":
+            keyword_task = asyncio.create_task(deadline.run(
+                "retrieval", timed("keyword_query", run_blocking("io", db.search_chunks, query, session_id, RETRIEVAL_TOP_K * 2)),
+                essential=False, default=[]
+            ))
+        ranked_lists = []
+        if mode != "keyword":
+            try:
+                vector_hits = await deadline.run(
+                    "vector", self._vector_search(query, session_id, RETRIEVAL_TOP_K * 2, deadline), essential=False
+                )
+                if vector_hits is not None:
+                    ranked_lists.append(vector_hits)
+            except Exception as e:
+                if keyword_task is None:
+                    raise
+                print(f"Vector retrieval failed, falling back to keyword search: {e}")
+        if keyword_task is not None:
+            try:
+                ranked_lists.append(await keyword_task)
+            except Exception as e:
+                print(f"Keyword retrieval failed: {e}")
+                if not ranked_lists:
+                    raise
+
+        context, hits, context_tokens = assemble_context(self._fuse(ranked_lists), max_chunks=RETRIEVAL_TOP_K)
+        CHUNKS_RETRIEVED.observe(len(hits))
+        CONTEXT_TOKENS.observe(context_tokens)
+        logger.debug(f"Retrieved {len(hits)} chunks ({context_tokens} tokens) for session_id='{session_id}' (mode={mode})")
+        context = context or "No document context found."
+        sources = sorted({h["metadata"].get("filename") for h in hits if h["metadata"].get("filename")})
+        return context, sources, context_tokens
+
+    async def _vector_search(self, query: str, session_id: str, n_results: int, deadline: Deadline = None):
+        """Over-fetches RERANK_CANDIDATES nearest chunks with their embeddings and reranks them with MMR.
+
+        If the rerank runs out of time, the n_results nearest by distance are returned instead.
+        """
+        deadline = deadline or Deadline(CHAT_BUDGET_SECONDS)
+        collection = await run_blocking("vector", self._session_collection, session_id, False) if session_id else self.collection
+        searched = [(collection, None)] if collection is not None else []
+        if session_id:
+            # Shared files the session references, next to anything stored in the session's own collection
+            for fingerprint in await run_blocking("io", db.get_session_fingerprints, session_id):
+                file_collection = await run_blocking("vector", self._file_collection, fingerprint, False)
+                if file_collection is not None:
+                    searched.append((file_collection, None))
+        if session_id and self._legacy_pending:
+            # Until the legacy migration finishes, older chunks may still sit in the shared collection
+            searched.append((self.collection, {"session_id": session_id}))
+        if not searched:
+            return []
+
+        query_embedding = (await self._embed_texts([query]))[0]
+        hits = []
+        with span("vector_query"):
+            results = await asyncio.gather(*(
+                run_blocking(
+                    "vector", target.query,
+                    query_embeddings=[query_embedding], 
+                    n_results=max(n_results, RERANK_CANDIDATES),
+                    where=where_filter,
+                    include=["documents", "metadatas", "distances", "embeddings"]
+                )
+                for target, where_filter in searched
+            ))
+        for docs in results:
+            if docs['ids'] and docs['ids'][0]:
+                hits.extend(
+                    {"id": i, "document": d, "metadata": m or {}, "distance": dist, "embedding": e}
+                    for i, d, m, dist, e in zip(
+                        docs['ids'][0], docs['documents'][0], docs['metadatas'][0], docs['distances'][0], docs['embeddings'][0]
+                    )
+                )
+        hits.sort(key=lambda h: h["distance"])
+        candidates = hits[:max(n_results, RERANK_CANDIDATES)]
+        reranked = await deadline.run(
+            "rerank", timed("rerank", run_blocking("vector", rerank_hits, query_embedding, candidates, n_results)),
+            essential=False
+        )
+        if reranked is None:
+            reranked = candidates[:n_results]
+        for hit in reranked:
+            hit.pop("embedding", None)
+        return reranked
+
+    @staticmethod
+    def _fuse(ranked_lists):
+        """Reciprocal-rank fusion: score(d) = sum(1 / (RRF_K + rank)) over every list d appears in."""
+        scores = {}
+        hits = {}
+        for ranked in ranked_lists:
+            for rank, hit in enumerate(ranked, start=1):
+                scores[hit["id"]] = scores.get(hit["id"], 0.0) + 1.0 / (RRF_K + rank)
+                hits.setdefault(hit["id"], hit)
+        return [hits[i] for i in sorted(scores, key=scores.get, reverse=True)]
+
+    async def _find_images(self, query: str, context: str, deadline: Deadline = None):
+        """Multimedia Search (Using Groq for reasoning-based query generation)."""
+        deadline = deadline or Deadline(CHAT_BUDGET_SECONDS)
+        images = []
+        try:
+            v_prompt = f"""
+            You are an expert visual researcher. Generate 3 SPECIFIC image search queries based on:
+            QUERY: {query}
+            CONTEXT fragments: {context[:2000]}
             
-            INSTRUCTIONS:
-            1. Check if the provided CONTEXT is relevant to the USER QUESTION.
-            2. If relevant, answer using the context.
-            3. If the context is IRRELEVANT or EMPTY, ignore it and answer using your General Knowledge.
-            4. NEVER say "There is no mention in the context". Just answer the question directly.
+            Format: exactly 3 lines, "Search Query | Why relevant".
             """
             
-            chat_resp = self.groq_client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"CONTEXT:\n{context}\n\nUSER QUESTION: {query}"}
-                ],
-                model="llama-3.3-70b-versatile"
+            # Groq (Llama 3.3) for smart search planning
+            with span("image_planning"):
+                v_resp = await upstream.call(
+                    "groq", "llm", self.groq_client.chat.completions.create,
+                    messages=[{"role": "user", "content": v_prompt}], 
+                    model="llama-3.3-70b-versatile",
+                    temperature=0.3,
+                    timeout=deadline.timeout_for("images"),
+                    deadline=deadline
+                )
+            
+            planned = [
+                line.split("|", 1) for line in v_resp.choices[0].message.content.strip().split('\n')[:3]
+                if "|" in line
+            ]
+            # The searches are independent, so they run concurrently; one failing doesn't drop the others
+            results = await asyncio.gather(
+                *(timed("image_search", run_blocking(
+                    "search", self._image_search, q_text.strip(), deadline.timeout_for("images")
+                  )) for q_text, _ in planned),
+                return_exceptions=True
             )
+            for (_, c_label), res in zip(planned, results):
+                if isinstance(res, Exception):
+                    print(f"Image search failed: {res}")
+                elif res:
+                    images.append({
+                        "url": res[0]['image'], 
+                        "thumbnail": res[0]['thumbnail'], 
+                        "title": res[0]['title'],
+                        "context_label": c_label.strip()
+                    })
+        except Exception as img_err:
+            print(f"Search failed: {img_err}")
+        return images
+
+    @staticmethod
+    def _answer_messages(query: str, context: str):
+        system_prompt = """You are Lumina AI. Use Markdown.
+        
+        INSTRUCTIONS:
+        1. Check if the provided CONTEXT is relevant to the USER QUESTION.
+        2. If relevant, answer using the context.
+        3. If the context is IRRELEVANT or EMPTY, ignore it and answer using your General Knowledge.
+        4. NEVER say "There is no mention in the context". Just answer the question directly.
+        """
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"CONTEXT:\n{context}\n\nUSER QUESTION: {query}"}
+        ]
+
+    @staticmethod
+    def _usage(context_tokens: int, completion_usage=None):
+        usage = {"context_tokens": context_tokens}
+        if completion_usage is not None:
+            usage["prompt_tokens"] = getattr(completion_usage, "prompt_tokens", None)
+            usage["completion_tokens"] = getattr(completion_usage, "completion_tokens", None)
+        return usage
+
+    async def query(self, query: str, include_images: bool, session_id: str = None, retrieval_mode: str = None,
+                    deadline: Deadline = None):
+        deadline = deadline or Deadline(CHAT_BUDGET_SECONDS)
+        images_task = None
+        try:
+            # 1. Context Retrieval (keyword + Google Embeddings)
+            context, _, context_tokens = await self._retrieve_context(query, session_id, retrieval_mode, deadline)
+
+            # 2. Multimedia Search runs alongside 3. Chat Response (Using Groq for superior language quality)
+            if include_images:
+                images_task = asyncio.create_task(deadline.run(
+                    "images", self._find_images(query, context, deadline), essential=False, default=[]
+                ))
+            chat_resp = await deadline.run("completion", timed("completion", upstream.call(
+                "groq", "llm", self.groq_client.chat.completions.create,
+                messages=self._answer_messages(query, context),
+                model="llama-3.3-70b-versatile",
+                timeout=deadline.timeout_for("completion"),
+                deadline=deadline
+            )))
+            images = await images_task if images_task else []
             
             return {
                 "answer": chat_resp.choices[0].message.content,
-                "images": images
+                "images": images,
+                "usage": self._usage(context_tokens, getattr(chat_resp, "usage", None)),
+                "skipped_stages": deadline.skipped
             }
         except Exception as e:
             print(f"Query Error: {e}")
-            return {"answer": f"Processing Error: {str(e)}", "images": []}
+            if images_task:
+                images_task.cancel()
+            return {"answer": f"Processing Error: {str(e)}", "images": [], "skipped_stages": deadline.skipped}
+
+    async def query_stream(self, query: str, include_images: bool, session_id: str = None, retrieval_mode: str = None,
+                           deadline: Deadline = None):
+        """Same pipeline as query, but yields (event, data) pairs: meta, then tokens, then images, then done."""
+        deadline = deadline or Deadline(CHAT_BUDGET_SECONDS)
+        images_task = None
+        stream = None
+        completion_usage = None
+        try:
+            context, sources, context_tokens = await self._retrieve_context(query, session_id, retrieval_mode, deadline)
+            yield "meta", {"sources": sources, "include_images": include_images, "context_tokens": context_tokens}
+
+            # Image search runs while the answer streams
+            if include_images:
+                images_task = asyncio.create_task(deadline.run(
+                    "images", self._find_images(query, context, deadline), essential=False, default=[]
+                ))
+
+            # Rate limits and retries apply to opening the stream; tokens are then read on the llm pool
+            started = time.perf_counter()
+            first_token = True
+            completion = await deadline.run("completion", upstream.call(
+                "groq", "llm", self.groq_client.chat.completions.create,
+                messages=self._answer_messages(query, context),
+                model="llama-3.3-70b-versatile",
+                stream=True,
+                timeout=deadline.timeout_for("completion"),
+                deadline=deadline
+            ))
+            stream = iterate_blocking("llm", iter, completion)
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=deadline.remaining())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    # Out of time mid-answer: keep what was streamed and say it was cut short
+                    deadline.skip("completion")
+                    break
+                # Groq reports token usage on the last chunk of a stream
+                completion_usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or completion_usage
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    if first_token:
+                        observe_stage("completion_first_token", time.perf_counter() - started)
+                        first_token = False
+                    yield "token", {"text": token}
+            observe_stage("completion", time.perf_counter() - started)
+
+            images = await images_task if images_task else []
+            images_task = None
+            yield "images", {"images": images}
+            yield "done", {"skipped_stages": deadline.skipped, "usage": self._usage(context_tokens, completion_usage)}
+        except Exception as e:
+            print(f"Query Stream Error: {e}")
+            yield "error", {"detail": f"Processing Error: {str(e)}"}
+        finally:
+            if stream is not None:
+                await stream.aclose()
+            if images_task and not images_task.done():
+                images_task.cancel()
 
     async def define_word(self, word: str, context: str = ""):
-        # Use Groq for context-aware definitions
-        prompt = f"Define '{word}' in 1-2 sentences within this context: {context}"
+        return (await self.define_words([(word, context)]))[0]
+
+    async def define_words(self, terms):
+        """Definitions for (word, context) pairs, in order: cached ones first, the rest from Groq.
+
+        Missing terms are defined DEFINE_BATCH_SIZE at a time, one completion per batch.
+        """
+        keys = [definition_key(word, context) for word, context in terms]
+        found = self.definition_cache.get_many(keys)
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        if missing:
+            found.update(await run_blocking("io", self.definition_cache.load, missing))
+        cached = set(found)
+        count_cache("definition", sum(1 for k in keys if k in cached), sum(1 for k in keys if k not in cached))
+        pending = {}
+        for key, (word, context) in zip(keys, terms):
+            if key not in found:
+                pending.setdefault(key, (word, context))
+        batches = [list(pending.items())[i:i + DEFINE_BATCH_SIZE] for i in range(0, len(pending), DEFINE_BATCH_SIZE)]
+        for defined in await asyncio.gather(*(self._define_uncached(batch) for batch in batches)):
+            found.update(defined)
+        return [
+            {"word": word, "definition": found.get(key, "Definition lookup failed."), "cached": key in cached}
+            for key, (word, _) in zip(keys, terms)
+        ]
+
+    async def _define_uncached(self, batch):
+        """One Groq call for a batch of (key, (word, context)); stores and returns {key: definition}."""
         try:
-            resp = self.groq_client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="llama-3.3-70b-versatile"
-            )
-            return {"definition": resp.choices[0].message.content}
-        except Exception:
-            return {"definition": "Definition lookup failed."}
+            if len(batch) == 1:
+                # Use Groq for context-aware definitions
+                _, (word, context) = batch[0]
+                prompt = f"Define '{word}' in 1-2 sentences within this context: {context}"
+                resp = await upstream.call(
+                    "groq", "llm", self.groq_client.chat.completions.create,
+                    messages=[{"role": "user", "content": prompt}],
+                    model="llama-3.3-70b-versatile"
+                )
+                definitions = {batch[0][0]: resp.choices[0].message.content}
+            else:
+                listing = "\n".join(
+                    f"{n}. {word}" + (f" (context: {context[:300]})" if context else "")
+                    for n, (_, (word, context)) in enumerate(batch, start=1)
+                )
+                prompt = (
+                    "Define each numbered term in 1-2 sentences, using its context where given.\n"
+                    'Reply with JSON only: {"definitions": {"<number>": "<definition>", ...}}\n\n' + listing
+                )
+                resp = await upstream.call(
+                    "groq", "llm", self.groq_client.chat.completions.create,
+                    messages=[{"role": "user", "content": prompt}],
+                    model="llama-3.3-70b-versatile",
+                    response_format={"type": "json_object"}
+                )
+                parsed = json.loads(resp.choices[0].message.content).get("definitions", {})
+                definitions = {
+                    key: str(parsed[str(n)]).strip()
+                    for n, (key, _) in enumerate(batch, start=1) if parsed.get(str(n))
+                }
+        except Exception as e:
+            print(f"Definition lookup failed: {e}")
+            return {}
+        words = dict((key, word) for key, (word, _) in batch)
+        await run_blocking(
+            "io", self.definition_cache.put_many, [(key, words[key], text) for key, text in definitions.items()]
+        )
+        return definitions
 
     def clear_storage(self):
-        """Wipes the ChromaDB knowledge base."""
+        """Wipes the ChromaDB knowledge base (the shared collection and every session and file collection)."""
         try:
-            self.chroma_client.delete_collection(name="lumina_notebook")
-            self.collection = self.chroma_client.get_or_create_collection(name="lumina_notebook")
+            with self._collections_lock:
+                self._session_collections.clear()
+                self._file_collections.clear()
+            prefixes = (f"{self.collection_name}-s-", f"{self.collection_name}-f-")
+            for collection in self.chroma_client.list_collections():
+                name = getattr(collection, "name", collection)
+                if name.startswith(prefixes):
+                    self.chroma_client.delete_collection(name=name)
+            self.chroma_client.delete_collection(name=self.collection_name)
+            self._collection = self._open_collection()
+            self._legacy_pending = False
             print("ChromaDB knowledge base cleared.")
         except Exception as e:
             print(f"Error clearing ChromaDB: {e}")
@@ -0,0 +1,54 @@
+import os
+
+# Vector candidates fetched per query before reranking down to the final few
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "24"))
+# 1.0 ranks purely by relevance; lower values favour chunks unlike the ones already picked
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Candidates whose cosine similarity to the query is below this are dropped (-1 keeps everything)
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "-1"))
+
+
+def _normalize(matrix):
+    import numpy as np
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr(query_vector, candidate_vectors, k: int, lambda_: float = MMR_LAMBDA, min_score: float = RERANK_MIN_SCORE):
+    """Maximal marginal relevance over cosine similarity; returns (indices, relevance scores) in pick order.
+
+    Each pick maximises lambda * sim(query, c) - (1 - lambda) * max sim(c, picked).
+    """
+    # Imported here so the app doesn't pay for numpy until the first query
+    import numpy as np
+    candidates = _normalize(np.asarray(candidate_vectors, dtype=np.float32))
+    query = _normalize(np.asarray(query_vector, dtype=np.float32))
+    relevance = candidates @ query
+    eligible = np.flatnonzero(relevance >= min_score)
+    if eligible.size == 0 or k <= 0:
+        return [], []
+    candidates, scores = candidates[eligible], relevance[eligible]
+    similarity = candidates @ candidates.T
+
+    picked = []
+    # Highest similarity of every candidate to anything picked so far, updated one row per pick
+    redundancy = np.full(len(eligible), -np.inf, dtype=np.float32)
+    available = np.ones(len(eligible), dtype=bool)
+    for _ in range(min(k, len(eligible))):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        marginal = lambda_ * scores - (1 - lambda_) * penalty
+        marginal[~available] = -np.inf
+        best = int(np.argmax(marginal))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return [int(eligible[i]) for i in picked], [float(scores[i]) for i in picked]
+
+
+def rerank_hits(query_vector, hits, k: int, lambda_: float = MMR_LAMBDA, min_score: float = RERANK_MIN_SCORE):
+    """Reorders vector hits (each with an "embedding") by MMR, keeping at most k; adds a "score" to each."""
+    if not hits:
+        return []
+    order, scores = mmr(query_vector, [h["embedding"] for h in hits], k, lambda_, min_score)
+    return [dict(hits[i], score=score) for i, score in zip(order, scores)]
@@ -0,0 +1,40 @@
+import os
+import codecs
+from services.executors import run_blocking
+
+# Bytes read from a spooled text upload per step; a segment is cut at the last paragraph break
+TEXT_READ_BYTES = int(os.getenv("TEXT_READ_BYTES", str(1024 * 1024)))
+# A paragraph longer than this many read steps is cut at a line break (or anywhere) instead
+TEXT_MAX_SEGMENT_STEPS = 4
+
+
+def _cut(buffer: str, force: bool):
+    """Index to split buffer at: after the last paragraph break, else the last line break if forced."""
+    cut = buffer.rfind("\n\n")
+    if cut != -1:
+        return cut + 2
+    if not force:
+        return 0
+    cut = buffer.rfind("\n")
+    return cut + 1 if cut != -1 else len(buffer)
+
+
+async def iter_text_segments(stream, encoding: str = "utf-8", block_size: int = TEXT_READ_BYTES):
+    """Yields (None, text) segments of a text file, decoding incrementally so only about one block is held at once.
+
+    Segments end on paragraph boundaries where possible, so chunkers see whole paragraphs.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+    stream.seek(0)
+    buffer = ""
+    while True:
+        block = await run_blocking("io", stream.read, block_size)
+        buffer += decoder.decode(block, final=not block)
+        if not block:
+            break
+        cut = _cut(buffer, force=len(buffer) >= block_size * TEXT_MAX_SEGMENT_STEPS)
+        if cut:
+            yield None, buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer:
+        yield None, buffer
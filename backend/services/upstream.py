@@ -0,0 +1,221 @@
+import os
+import time
+import random
+import asyncio
+import collections
+import email.utils
+import urllib.error
+from services.executors import run_blocking
+from services.metrics import span, UPSTREAM_ERRORS, UPSTREAM_RETRIES
+
+# Requests per minute each provider's quota allows, how many calls may be in flight at once, and how
+# many may start back to back before the per-minute rate spaces them out (defaults to the concurrency).
+# Concurrency starts at the ceiling, halves on every 429/5xx and creeps back up as calls succeed.
+PROVIDER_LIMITS = {
+    "gemini": {
+        "rpm": float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "1500")),
+        "concurrency": int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+        "burst": float(os.getenv("GEMINI_BURST", os.getenv("GEMINI_MAX_CONCURRENCY", "8"))),
+    },
+    "groq": {
+        "rpm": float(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30")),
+        "concurrency": int(os.getenv("GROQ_MAX_CONCURRENCY", "4")),
+        "burst": float(os.getenv("GROQ_BURST", os.getenv("GROQ_MAX_CONCURRENCY", "4"))),
+    },
+}
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "5"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_CAP = float(os.getenv("UPSTREAM_BACKOFF_CAP", "30"))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+_TRANSIENT_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectTimeout"}
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float):
+        """Holds every caller back, e.g. for the Retry-After the provider asked for."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, cost: float = 1.0):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with additive increase / multiplicative decrease (AIMD)."""
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._waiters = collections.deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self):
+        # Roughly +1 for every `limit` successes, i.e. one step per round of calls
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+def _status_of(exc):
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    # httpx.HTTPStatusError only carries the status on its response
+    value = getattr(getattr(exc, "response", None), "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after(exc):
+    """Seconds from a Retry-After header on the failed response, if the provider sent one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(parsed.timestamp() - time.time(), 0.0) if parsed else None
+
+
+def _is_retryable(exc, status):
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exc, urllib.error.HTTPError):
+        return False
+    return isinstance(exc, (ConnectionError, TimeoutError, urllib.error.URLError)) or type(exc).__name__ in _TRANSIENT_ERRORS
+
+
+class Upstream:
+    """Schedules blocking calls to one provider: rate limit, adaptive concurrency and retries."""
+
+    def __init__(self, name: str, rpm: float, concurrency: int, burst: float = None):
+        self.name = name
+        # Sized by the burst rather than the rate, so a slow per-minute quota still lets a chat's
+        # completion and image planning (or a few concurrent chats) start together
+        self.bucket = TokenBucket(rpm / 60.0, capacity=max(1.0, burst if burst is not None else concurrency))
+        self.limiter = AdaptiveLimiter(concurrency)
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def _backoff(self, attempt):
+        # Full jitter keeps a burst of throttled callers from retrying in lockstep
+        return random.uniform(0, min(UPSTREAM_BACKOFF_CAP, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+    async def call(self, pool: str, fn, *args, deadline=None, **kwargs):
+        """Runs fn on the named pool once a rate-limit token and a concurrency slot are free.
+
+        Transient failures are retried with jittered backoff, never sooner than Retry-After and
+        never past the deadline, if one is given.
+        """
+        attempt = 0
+        while True:
+            # Time spent waiting on the rate limit or a concurrency slot, per provider
+            with span(f"{self.name}_wait"):
+                await self.bucket.acquire()
+                await self.limiter.acquire()
+            self.calls += 1
+            try:
+                result = await run_blocking(pool, fn, *args, **kwargs)
+            except Exception as e:
+                status = _status_of(e)
+                UPSTREAM_ERRORS.inc(provider=self.name, status=status or type(e).__name__)
+                if status == 429 or (status or 0) >= 500:
+                    self.throttled += 1
+                    self.limiter.on_throttle()
+                retry_after = _retry_after(e)
+                if retry_after and status == 429:
+                    self.bucket.pause(retry_after)
+                delay = max(retry_after or 0.0, self._backoff(attempt))
+                if (
+                    not _is_retryable(e, status)
+                    or attempt >= UPSTREAM_MAX_RETRIES
+                    or (deadline is not None and delay >= deadline.remaining())
+                ):
+                    self.failures += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                UPSTREAM_RETRIES.inc(provider=self.name)
+                print(f"{self.name} call failed ({status or type(e).__name__}), retry {attempt} in {delay:.1f}s")
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                # Also runs when the caller is cancelled, e.g. by a deadline
+                self.limiter.release()
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "concurrency_limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+        }
+
+
+PROVIDERS = {name: Upstream(name, **limits) for name, limits in PROVIDER_LIMITS.items()}
+
+
+async def call(provider: str, pool: str, fn, *args, deadline=None, **kwargs):
+    """Shorthand for PROVIDERS[provider].call(...)."""
+    return await PROVIDERS[provider].call(pool, fn, *args, deadline=deadline, **kwargs)
+
+
+def stats():
+    return {name: upstream.stats() for name, upstream in PROVIDERS.items()}
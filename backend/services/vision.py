@@ -0,0 +1,119 @@
+import io
+import os
+import json
+import base64
+import asyncio
+import threading
+from services.executors import run_blocking
+from services import upstream
+from services.metrics import span
+
+VISION_MODEL = os.getenv("VISION_MODEL", "gemini-2.0-flash")
+VISION_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{VISION_MODEL}:generateContent"
+# Images are downscaled so their longest side is at most this many pixels, then re-encoded as JPEG
+VISION_MAX_DIM = int(os.getenv("VISION_MAX_DIM", "1568"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+# Vision requests in flight at once, across every upload being ingested
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "4"))
+
+VISION_PROMPT = "1. Transcribe ALL visible text in this image exactly as it appears. \n2. Describe the layout and visual elements in detail.\n\nOutput format:\nOCR TRANSCRIPTION:\n[Text here]\n\nVISUAL DESCRIPTION:\n[Description here]"
+
+# Multiple of 3 bytes, so each piece base64-encodes without padding
+_B64_PIECE = 3 * 16 * 1024
+
+_client = None
+_client_lock = threading.Lock()
+_semaphore = asyncio.Semaphore(VISION_CONCURRENCY)
+
+
+def get_client():
+    """Shared keep-alive httpx.Client, so consecutive images reuse the TLS connection to Gemini."""
+    global _client
+    import httpx
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(
+                limits=httpx.Limits(max_connections=VISION_CONCURRENCY, max_keepalive_connections=VISION_CONCURRENCY),
+                headers={"x-goog-api-key": os.getenv("GOOGLE_GENERATIVE_AI_API_KEY") or ""},
+            )
+        return _client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def prepare_image(fileobj, mime_type: str, max_dim: int = VISION_MAX_DIM):
+    """Returns (bytes, mime_type) to send: the image downscaled to max_dim and re-encoded as JPEG.
+
+    The original is kept when re-encoding doesn't make it smaller, or when it can't be decoded.
+    """
+    from PIL import Image, ImageOps
+    fileobj.seek(0, os.SEEK_END)
+    original_size = fileobj.tell()
+    fileobj.seek(0)
+    try:
+        image = Image.open(fileobj)
+        # JPEGs can be decoded straight at a reduced scale, which avoids holding the full-size bitmap
+        image.draft("RGB", (max_dim, max_dim))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dim, max_dim))
+        if image.mode not in ("RGB", "L"):
+            background = Image.new("RGB", image.size, "white")
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        print(f"Image could not be re-encoded, sending original: {e}")
+        fileobj.seek(0)
+        return fileobj.read(), mime_type
+    if out.tell() >= original_size:
+        fileobj.seek(0)
+        return fileobj.read(), mime_type
+    return out.getvalue(), "image/jpeg"
+
+
+def _request_body(image_bytes: bytes, mime_type: str):
+    """JSON body as (length, chunks): the base64 payload is encoded piece by piece as it is sent."""
+    head = ('{"contents":[{"parts":[{"inline_data":{"mime_type":"%s","data":"' % mime_type).encode()
+    tail = ('"}},{"text":%s}]}]}' % json.dumps(VISION_PROMPT)).encode()
+    view = memoryview(image_bytes)
+
+    def chunks():
+        yield head
+        for start in range(0, len(view), _B64_PIECE):
+            yield base64.b64encode(view[start:start + _B64_PIECE])
+        yield tail
+
+    length = len(head) + 4 * ((len(image_bytes) + 2) // 3) + len(tail)
+    return length, chunks()
+
+
+def _generate(image_bytes: bytes, mime_type: str, timeout: float):
+    length, body = _request_body(image_bytes, mime_type)
+    response = get_client().post(
+        VISION_URL,
+        content=body,
+        headers={"Content-Type": "application/json", "Content-Length": str(length)},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    result = response.json()
+    return result['candidates'][0]['content']['parts'][0]['text']
+
+
+async def describe_image(fileobj, mime_type: str, deadline):
+    """OCR plus a visual description of an uploaded image, through the shared Gemini scheduler."""
+    async with _semaphore:
+        with span("image_prepare"):
+            image_bytes, send_type = await run_blocking("vision", prepare_image, fileobj, mime_type)
+        with span("vision"):
+            return await upstream.call(
+                "gemini", "vision", _generate, image_bytes, send_type, deadline.timeout_for("vision"), deadline=deadline
+            )
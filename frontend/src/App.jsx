@@ -5,6 +5,9 @@ import ReactMarkdown from 'react-markdown';
 import './App.css';
 import WordOverlay from './WordOverlay';
 
+// Sessions and messages are fetched in pages of this size
+const PAGE_SIZE = 50;
+
 export default function App() {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState("");
@@ -16,6 +19,9 @@ export default function App() {
   // Session State
   const [sessions, setSessions] = useState([]);
   const [currentSessionId, setCurrentSessionId] = useState(null);
+  // Cursors for the next page of sessions and for older messages of the open session (null = no more)
+  const [sessionsCursor, setSessionsCursor] = useState(null);
+  const [historyCursor, setHistoryCursor] = useState(null);
 
   // Menu State
   const [activeMenuId, setActiveMenuId] = useState(null);
@@ -58,8 +64,19 @@ export default function App() {
 
   const fetchSessions = async () => {
     try {
-      const res = await axios.get("http://localhost:8000/sessions");
-      setSessions(res.data);
+      const res = await axios.get(`http://localhost:8000/sessions?limit=${PAGE_SIZE}`);
+      setSessions(res.data.sessions);
+      setSessionsCursor(res.data.next_cursor);
+    } catch (err) {
+      console.error("Failed to fetch sessions", err);
+    }
+  };
+
+  const loadMoreSessions = async () => {
+    try {
+      const res = await axios.get(`http://localhost:8000/sessions?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(sessionsCursor)}`);
+      setSessions(prev => [...prev, ...res.data.sessions]);
+      setSessionsCursor(res.data.next_cursor);
     } catch (err) {
       console.error("Failed to fetch sessions", err);
     }
@@ -70,6 +87,7 @@ export default function App() {
       const res = await axios.post("http://localhost:8000/sessions");
       setCurrentSessionId(res.data.session_id);
       setMessages([]);
+      setHistoryCursor(null);
       setUploadedFile(null);
       fetchSessions();
       // Close mobile sidebar
@@ -87,8 +105,9 @@ export default function App() {
     try {
       setLoading(true);
       setCurrentSessionId(sessionId);
-      const res = await axios.get(`http://localhost:8000/sessions/${sessionId}`);
+      const res = await axios.get(`http://localhost:8000/sessions/${sessionId}?limit=${PAGE_SIZE}`);
       setMessages(res.data.messages || []);
+      setHistoryCursor(res.data.next_cursor);
       setLoading(false);
       if (window.innerWidth < 768) setSidebarOpen(false);
     } catch (err) {
@@ -97,6 +116,16 @@ export default function App() {
     }
   };
 
+  const loadEarlierMessages = async () => {
+    try {
+      const res = await axios.get(`http://localhost:8000/sessions/${currentSessionId}?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(historyCursor)}`);
+      setMessages(prev => [...(res.data.messages || []), ...prev]);
+      setHistoryCursor(res.data.next_cursor);
+    } catch (err) {
+      console.error("Failed to load earlier messages", err);
+    }
+  };
+
   const updateSession = async (sessionId, updates) => {
     try {
       await axios.put(`http://localhost:8000/sessions/${sessionId}`, updates);
@@ -113,6 +142,7 @@ export default function App() {
       if (currentSessionId === sessionId) {
         setCurrentSessionId(null);
         setMessages([]);
+        setHistoryCursor(null);
       }
       fetchSessions();
     } catch (err) {
@@ -125,7 +155,9 @@ export default function App() {
     try {
       await axios.delete("http://localhost:8000/sessions");
       setSessions([]);
+      setSessionsCursor(null);
       setMessages([]);
+      setHistoryCursor(null);
       setCurrentSessionId(null);
     } catch (err) {
       console.error("Clear all failed", err);
@@ -255,7 +287,14 @@ export default function App() {
     formData.append('file', file);
     formData.append('session_id', currentSessionId);
     try {
-      await axios.post("http://localhost:8000/upload", formData);
+      const res = await axios.post("http://localhost:8000/upload", formData);
+      // Ingestion runs in the background; poll the job until it settles
+      let job = res.data;
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise(r => setTimeout(r, 1000));
+        job = (await axios.get(`http://localhost:8000/upload/${res.data.job_id}`)).data;
+      }
+      if (job.status === "failed") throw new Error(job.error);
       setUploadedFile({ name: file.name, uploading: false });
       textareaRef.current?.focus();
     } catch {
@@ -373,6 +412,11 @@ export default function App() {
               )}
             </div>
           ))}
+          {sessionsCursor && (
+            <div className="nav-item" onClick={loadMoreSessions}>
+              <span className="nav-text">Show more</span>
+            </div>
+          )}
         </div>
 
         <div className="sidebar-footer">
@@ -398,6 +442,11 @@ export default function App() {
               <p>How can I help you today?</p>
             </div>
           )}
+          {historyCursor && (
+            <button className="footer-btn" onClick={loadEarlierMessages} style={{ alignSelf: 'center' }}>
+              Load earlier messages
+            </button>
+          )}
           {messages.map((m, i) => (
             <div key={i} className={`msg-row ${m.role}`}>
               <div className="avatar">{m.role === 'bot' ? <Bot size={18} /> : <User size={18} />}</div>
@@ -0,0 +1,119 @@
+"""
+Micro-benchmark for the chunking strategies. Runs fully offline:
+
+    python tests/bench_chunking.py [path/to/document.md] [--tokens N] [--overlap N]
+
+For each strategy it reports chunk count, embedded tokens (embedding cost, overlap included),
+split time, and retrieval hit rate: sentences sampled from the document are turned into noisy
+queries, and a hit means the top TF-IDF chunk contains the whole original sentence.
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import random
+from collections import Counter
+
+# Add backend to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+from services.chunking import get_chunker, count_tokens, CHUNKERS, CHUNK_TOKENS, CHUNK_OVERLAP
+
+
+WORD_RE = re.compile(r"\w+")
+SENTENCE_RE = re.compile(r"[^.!?\n]{40,}[.!?]")
+
+TOPICS = ["database", "embedding", "network", "cache", "scheduler", "parser", "renderer", "compiler"]
+VERBS = ["stores", "rebuilds", "validates", "streams", "indexes", "compresses", "retries", "shards"]
+OBJECTS = ["session records", "vector batches", "page images", "token budgets", "query plans", "config files"]
+
+
+def synthetic_document(sections=40, seed=7):
+    """Markdown handbook with prose, fenced code and tables, similar to what users upload."""
+    rng = random.Random(seed)
+    parts = []
+    for s in range(sections):
+        topic = rng.choice(TOPICS)
+        parts.append(f"## {topic.title()} section {s}\n")
+        for _ in range(rng.randint(2, 4)):
+            sentences = []
+            for _ in range(rng.randint(3, 6)):
+                code = f"E{rng.randint(1000, 9999)}"
+                sentences.append(
+                    f"The {topic} module {rng.choice(VERBS)} {rng.choice(OBJECTS)} and reports error {code} "
+                    f"when the {rng.choice(TOPICS)} layer {rng.choice(VERBS)} too many {rng.choice(OBJECTS)}."
+                )
+            parts.append(" ".join(sentences) + "\n")
+        if s % 3 == 0:
+            parts.append(f"```python\ndef handle_{topic}_{s}(batch):\n    for item in batch:\n        item.retry(limit={s})\n    return batch\n```\n")
+        if s % 4 == 0:
+            parts.append("| setting | value |\n|---|---|\n" + "".join(f"| {topic}_{k} | {rng.randint(1, 99)} |\n" for k in range(4)))
+    return "\n".join(parts)
+
+
+def tfidf_index(chunks):
+    docs = [Counter(w.lower() for w in WORD_RE.findall(c["text"])) for c in chunks]
+    df = Counter(w for d in docs for w in d)
+    idf = {w: math.log((1 + len(docs)) / (1 + n)) + 1 for w, n in df.items()}
+    vectors = []
+    for d in docs:
+        v = {w: tf * idf[w] for w, tf in d.items()}
+        norm = math.sqrt(sum(x * x for x in v.values())) or 1.0
+        vectors.append({w: x / norm for w, x in v.items()})
+    return vectors, idf
+
+
+def top1(query, vectors, idf):
+    q = Counter(w.lower() for w in WORD_RE.findall(query))
+    best, best_score = None, -1.0
+    for i, v in enumerate(vectors):
+        score = sum(tf * idf.get(w, 0.0) * v.get(w, 0.0) for w, tf in q.items())
+        if score > best_score:
+            best, best_score = i, score
+    return best
+
+
+def noisy_query(sentence, rng):
+    words = sentence.split()
+    return " ".join(w for i, w in enumerate(words) if i % 3 != 1 or rng.random() < 0.3)
+
+
+def run(text, max_tokens, overlap, samples=200):
+    rng = random.Random(11)
+    sentences = SENTENCE_RE.findall(text)
+    probes = [s.strip() for s in rng.sample(sentences, min(samples, len(sentences)))]
+    queries = [noisy_query(s, rng) for s in probes]
+
+    print(f"Document: {len(text)} chars, ~{count_tokens(text)} tokens, {len(probes)} probe queries")
+    print(f"Budget: {max_tokens} tokens, overlap {overlap}\n")
+    print(f"{'strategy':<10} {'chunks':>7} {'embed tokens':>13} {'max tokens':>11} {'split ms':>9} {'hit rate':>9}")
+    for name in CHUNKERS:
+        chunker = get_chunker(name, max_tokens=max_tokens, overlap=overlap)
+        start = time.perf_counter()
+        chunks = chunker.split(text)
+        elapsed = (time.perf_counter() - start) * 1000
+        vectors, idf = tfidf_index(chunks)
+        hits = sum(1 for p, q in zip(probes, queries) if p in chunks[top1(q, vectors, idf)]["text"])
+        embed_tokens = sum(c["tokens"] for c in chunks)
+        max_chunk = max(c["tokens"] for c in chunks)
+        print(f"{name:<10} {len(chunks):>7} {embed_tokens:>13} {max_chunk:>11} {elapsed:>9.1f} {hits / len(probes):>9.1%}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    max_tokens, overlap = CHUNK_TOKENS, CHUNK_OVERLAP
+    if "--tokens" in args:
+        i = args.index("--tokens")
+        max_tokens = int(args[i + 1])
+        del args[i:i + 2]
+    if "--overlap" in args:
+        i = args.index("--overlap")
+        overlap = int(args[i + 1])
+        del args[i:i + 2]
+    if args:
+        with open(args[0], encoding="utf-8", errors="ignore") as f:
+            document = f.read()
+    else:
+        document = synthetic_document()
+    run(document, max_tokens, overlap)
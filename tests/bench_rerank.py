@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for the MMR rerank step. Runs fully offline:
+
+    python tests/bench_rerank.py [--dim N] [--k N] [--repeat N]
+
+For growing candidate counts it reports the median rerank time and how many near-duplicate
+candidates end up in the top k, for MMR against plain relevance order. Candidates are random
+unit vectors, a third of them clustered around a few "duplicate" points near the query.
+"""
+
+import os
+import sys
+import time
+import statistics
+import numpy as np
+
+# Add backend to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+from services.rerank import mmr, MMR_LAMBDA
+
+CANDIDATE_COUNTS = [8, 16, 24, 48, 96, 200, 500, 1000]
+
+
+def synthetic_candidates(n, dim, rng):
+    query = rng.standard_normal(dim)
+    candidates = rng.standard_normal((n, dim)) + query
+    clusters = rng.standard_normal((3, dim)) + 1.2 * query
+    duplicates = np.arange(0, n, 3)
+    candidates[duplicates] = clusters[(duplicates // 3) % 3] + 0.05 * rng.standard_normal((len(duplicates), dim))
+    return query, candidates, set(duplicates.tolist())
+
+
+def duplicates_in(order, duplicates):
+    return sum(1 for i in order if i in duplicates)
+
+
+def run(dim, k, repeat):
+    rng = np.random.default_rng(3)
+    print(f"dim {dim}, k {k}, lambda {MMR_LAMBDA}, median of {repeat} runs\n")
+    print(f"{'candidates':>10} {'mmr ms':>8} {'dups (mmr)':>11} {'dups (top-k)':>13}")
+    for n in CANDIDATE_COUNTS:
+        query, candidates, duplicates = synthetic_candidates(n, dim, rng)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            order, _ = mmr(query, candidates, k)
+            timings.append((time.perf_counter() - start) * 1000)
+        relevance = (candidates / np.linalg.norm(candidates, axis=1, keepdims=True)) @ (query / np.linalg.norm(query))
+        top_k = np.argsort(-relevance)[:k].tolist()
+        print(f"{n:>10} {statistics.median(timings):>8.2f} {duplicates_in(order, duplicates):>11} {duplicates_in(top_k, duplicates):>13}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--dim": 3072, "--k": 8, "--repeat": 20}
+    for name in options:
+        if name in args:
+            i = args.index(name)
+            options[name] = int(args[i + 1])
+            del args[i:i + 2]
+    run(options["--dim"], options["--k"], options["--repeat"])
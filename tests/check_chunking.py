@@ -0,0 +1,70 @@
+"""
+Regression check for the chunking strategies on awkward input. Runs fully offline:
+
+    python tests/check_chunking.py [--tokens N] [--overlap N] [--seed N]
+
+Feeds every strategy text with long whitespace-free runs (minified JSON, base64, URLs) plus
+random fuzz, and fails if a strategy raises, returns a chunk over the token budget (the fixed
+character slicer is exempt), or reports offsets that don't match the chunk text.
+"""
+
+import os
+import sys
+import base64
+import random
+
+# Add backend to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+from services.chunking import get_chunker, count_tokens, CHUNKERS, CHUNK_TOKENS, CHUNK_OVERLAP
+
+FUZZ_CASES = 200
+
+
+def awkward_documents(rng):
+    yield "minified json", "payload: " + '{"a":[1,2,3],"b":{"c":"d"}},' * 20
+    yield "base64", "blob " + base64.b64encode(bytes(rng.randrange(256) for _ in range(6000))).decode()
+    yield "long url", "See https://example.com/" + "/".join(f"seg-{i}?q={i}&r=x" for i in range(400)) + " for details."
+    yield "markdown table", "# Data\n\n| " + "|".join(str(i) for i in range(2000)) + " |\n\nAfter the table."
+    yield "code", "def f():\n    return " + "+".join(f"x[{i}]" for i in range(800)) + "\n"
+    alphabet = "ab1 .,;{}[]()\"'/\n#|`"
+    for n in range(FUZZ_CASES):
+        yield f"fuzz {n}", "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 3000)))
+
+
+def check(max_tokens, overlap, seed):
+    rng = random.Random(seed)
+    documents = list(awkward_documents(rng))
+    failures = 0
+    for name in CHUNKERS:
+        chunker = get_chunker(name, max_tokens=max_tokens, overlap=overlap)
+        for label, text in documents:
+            try:
+                chunks = chunker.split(text)
+            except Exception as e:
+                print(f"{name:>9} {label}: raised {type(e).__name__}: {str(e)[:80]}")
+                failures += 1
+                continue
+            for chunk in chunks:
+                if chunk["text"] != text[chunk["start"]:chunk["end"]]:
+                    print(f"{name:>9} {label}: offsets {chunk['start']}..{chunk['end']} don't match the chunk text")
+                    failures += 1
+                    break
+                if name != "fixed" and count_tokens(chunk["text"]) > max_tokens:
+                    print(f"{name:>9} {label}: chunk of {count_tokens(chunk['text'])} tokens (budget {max_tokens})")
+                    failures += 1
+                    break
+    print(f"{len(CHUNKERS)} strategies x {len(documents)} documents, {failures} failures")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--tokens": CHUNK_TOKENS, "--overlap": CHUNK_OVERLAP, "--seed": 11}
+    for name in options:
+        if name in args:
+            i = args.index(name)
+            options[name] = int(args[i + 1])
+            del args[i:i + 2]
+    check(options["--tokens"], options["--overlap"], options["--seed"])
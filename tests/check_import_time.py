@@ -0,0 +1,69 @@
+"""
+Import-time budget for the API. Imports backend/main.py in a fresh interpreter with no API keys
+set and fails if it takes longer than the budget:
+
+    python tests/check_import_time.py [--budget-ms N] [--top N]
+
+Prints the slowest imports (cumulative, from python -X importtime) so a regression points at
+the module that caused it. Heavy SDKs (chromadb, google-genai, groq, pypdf, numpy, Pillow,
+httpx) should only load on first use or during warmup, never at import.
+"""
+
+import os
+import re
+import sys
+import subprocess
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+DEFAULT_BUDGET_MS = 1000
+HEAVY_MODULES = ["chromadb", "google.genai", "groq", "duckduckgo_search", "pypdf", "numpy", "PIL", "httpx"]
+
+LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure():
+    env = {k: v for k, v in os.environ.items() if k not in ("GOOGLE_GENERATIVE_AI_API_KEY", "GROQ_API_KEY")}
+    code = "import sys, main; print('\\n'.join(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(f"Importing main failed (exit code {result.returncode})")
+    timings = []
+    for line in result.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if m:
+            timings.append((int(m.group(2)), len(m.group(3)) // 2, m.group(4)))
+    return timings, set(result.stdout.split())
+
+
+def run(budget_ms, top):
+    timings, modules = measure()
+    total_ms = next(us for us, _, name in timings if name == "main") / 1000
+    print(f"import main: {total_ms:.0f} ms (budget {budget_ms} ms)\n")
+    print(f"{'cumulative ms':>13}  module")
+    for us, depth, name in sorted(timings, reverse=True)[:top]:
+        print(f"{us / 1000:>13.1f}  {'  ' * depth}{name}")
+
+    loaded = [m for m in HEAVY_MODULES if m in modules]
+    if loaded:
+        print(f"\nHeavy modules loaded at import: {', '.join(loaded)}")
+    if total_ms > budget_ms or loaded:
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    budget_ms, top = DEFAULT_BUDGET_MS, 15
+    if "--budget-ms" in args:
+        i = args.index("--budget-ms")
+        budget_ms = int(args[i + 1])
+        del args[i:i + 2]
+    if "--top" in args:
+        i = args.index("--top")
+        top = int(args[i + 1])
+        del args[i:i + 2]
+    run(budget_ms, top)